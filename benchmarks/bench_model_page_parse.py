@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grog import extract_initial_prediction_data, fetch_replicate_model_page
+from fixtures.generate_model_page import generate_model_page
+
+# Compares the script tag scanner used by grog with the BeautifulSoup parsing it
+# replaced, on model pages saved from replicate.com, or without any on a
+# synthetic page (benchmarks/fixtures/generate_model_page.py):
+#
+#   python benchmarks/bench_model_page_parse.py
+#   python benchmarks/bench_model_page_parse.py --synthetic_size 20
+#   python benchmarks/bench_model_page_parse.py --save fofr/face-to-sticker
+#   python benchmarks/bench_model_page_parse.py benchmarks/fixtures/*.html
+#
+# The BeautifulSoup baseline needs `pip install beautifulsoup4`.
+
+
+def extract_with_beautifulsoup(html_content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, "html.parser")
+    for script_tag in soup.find_all("script", {"type": "application/json"}):
+        if "initialPrediction" in script_tag.string:
+            return json.loads(script_tag.string)
+    raise ValueError("Data with 'initialPrediction' not found in the HTML content.")
+
+
+def measure(extract, html_content, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = extract(html_content)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    extract(html_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, min(timings), peak
+
+
+def save_fixture(model_id, fixtures_dir):
+    html_content, _ = fetch_replicate_model_page(model_id)
+    os.makedirs(fixtures_dir, exist_ok=True)
+    path = os.path.join(fixtures_dir, model_id.replace("/", "--") + ".html")
+    with open(path, "w") as file:
+        file.write(html_content)
+    print(f"Saved {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model page parsing.")
+    parser.add_argument("pages", nargs="*", help="Saved model page HTML files.")
+    parser.add_argument(
+        "--save",
+        nargs="*",
+        default=[],
+        help="Replicate model ids to download as fixtures before benchmarking.",
+    )
+    parser.add_argument(
+        "--fixtures_dir",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"),
+    )
+    parser.add_argument(
+        "--synthetic_size",
+        type=float,
+        default=5,
+        help="Size in MB of the synthetic page used when no pages are given.",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages + [save_fixture(m, args.fixtures_dir) for m in args.save]:
+        with open(path, "r") as file:
+            pages.append((os.path.basename(path), file.read()))
+    if not pages:
+        size = int(args.synthetic_size * 1024**2)
+        pages.append(
+            (f"synthetic {args.synthetic_size:g}MB", generate_model_page(size))
+        )
+
+    extractors = [
+        ("scan", extract_initial_prediction_data),
+        ("beautifulsoup", extract_with_beautifulsoup),
+    ]
+    print(f"{'page':40} {'parser':14} {'best time':>10} {'peak memory':>12}")
+    for page, html_content in pages:
+        results = {}
+        for name, extract in extractors:
+            try:
+                data, best, peak = measure(extract, html_content, args.repeat)
+            except ImportError:
+                print(f"{page:40} {name:14} {'skipped (not installed)':>23}")
+                continue
+            results[name] = data
+            print(
+                f"{page:40} {name:14} {best * 1000:>8.1f}ms {peak / 1024**2:>10.1f}MB"
+            )
+        if len(results) == 2 and results["scan"] != results["beautifulsoup"]:
+            print(f"{page}: parsers disagree!")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
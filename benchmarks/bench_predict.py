@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from utils.admission import AdmissionQueue
+from utils.backend_pool import BackendPool
+from utils.gradio_helpers import (
+    build_gradio_inputs,
+    build_gradio_outputs_replicate,
+    create_dynamic_gradio_app,
+)
+from utils.metrics import STAGE_METRIC, Metrics
+from utils.output_store import OutputStore
+from utils.prediction_helpers import WEBHOOK_PATH, WebhookReceiver
+
+# Drives the predict function of the dynamic app against fake cog servers
+# (benchmarks/fake_cog_server.py) and reports throughput, latency percentiles,
+# the time grog adds on top of the model and memory use:
+#
+#   python benchmarks/bench_predict.py --requests 200 --concurrency 16
+#   python benchmarks/bench_predict.py --replicas 4 --busy --latency 0.2
+#   python benchmarks/bench_predict.py --mode async --output_size 5000000
+#   python benchmarks/bench_predict.py --mode webhook --busy
+#   python benchmarks/bench_predict.py --max_overhead_ms 20
+#
+# The fake servers run in their own processes, so they don't compete with the
+# app for the GIL. --mode webhook submits predictions like grog does to a local
+# cog, with PUT and Prefer: respond-async, and receives them on a webhook.
+
+INPUT_SCHEMA = [("prompt", {"type": "string", "title": "Prompt"})]
+
+
+class FakeRequest:
+    url = "http://127.0.0.1:7860/"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_servers(args):
+    processes, urls = [], []
+    for _ in range(args.replicas):
+        port = free_port()
+        command = [
+            sys.executable,
+            os.path.join(REPO_DIR, "benchmarks", "fake_cog_server.py"),
+            "--port",
+            str(port),
+            "--latency",
+            str(args.latency),
+            "--mode",
+            "async" if args.mode == "async" else "sync",
+            "--output_size",
+            str(args.output_size),
+        ]
+        if args.busy:
+            command.append("--busy")
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+        urls.append(f"http://127.0.0.1:{port}/predictions")
+    for url in urls:
+        wait_for_server(url.replace("/predictions", "/health-check"))
+    return processes, urls
+
+
+def wait_for_server(health_url, timeout=10):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            if requests.get(health_url, timeout=1).json()["status"] == "READY":
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.05)
+    raise Exception(f"The fake cog server at {health_url} did not start")
+
+
+def start_webhook_server(receiver):
+    # Stands in for the webhook route of the Gradio server
+    class WebhookHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            query = parse_qs(urlparse(self.path).query)
+            receiver.deliver(body, self.headers, query.get("token", [None])[0])
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{WEBHOOK_PATH}"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def stage_means(metrics):
+    # Mean seconds per stage, read back from the metrics the app recorded
+    sums, counts = {}, {}
+    for line in metrics.render().splitlines():
+        if not line.startswith(f"{STAGE_METRIC}_sum") and not line.startswith(
+            f"{STAGE_METRIC}_count"
+        ):
+            continue
+        sample, value = line.rsplit(" ", 1)
+        stage = sample.split('stage="')[1].split('"')[0]
+        target = sums if sample.startswith(f"{STAGE_METRIC}_sum") else counts
+        target[stage] = target.get(stage, 0) + float(value)
+    return {stage: sums[stage] / counts[stage] for stage in sums if counts[stage]}
+
+
+def create_app(args, urls, metrics, output_dir, webhook_receiver, webhook_url):
+    inputs, _, names = build_gradio_inputs(INPUT_SCHEMA)
+    outputs, _ = build_gradio_outputs_replicate(
+        ["image"] if args.output_size else ["string"]
+    )
+    max_concurrency = args.max_concurrency
+    if max_concurrency is None:
+        max_concurrency = args.replicas if args.busy else 0
+    app = create_dynamic_gradio_app(
+        inputs,
+        outputs,
+        api_url=urls[0],
+        names=names,
+        output_store=OutputStore(output_dir),
+        backend_pool=BackendPool(urls) if len(urls) > 1 else None,
+        admission_queue=(
+            AdmissionQueue(max_concurrency, max_queue_size=0)
+            if max_concurrency
+            else None
+        ),
+        poll_interval_max=args.poll_interval_max,
+        metrics=metrics,
+        completion_mode="webhook" if args.mode == "webhook" else "poll",
+        webhook_receiver=webhook_receiver,
+        webhook_url=webhook_url,
+        cog_async=args.mode == "webhook",
+    )
+    return [fn.fn for fn in app.fns if getattr(fn.fn, "__name__", "") == "predict"][0]
+
+
+async def run_load(predict, requests_count, concurrency):
+    latencies, failures = [], []
+    next_request = iter(range(requests_count))
+
+    async def worker():
+        for i in next_request:
+            started = time.perf_counter()
+            try:
+                async for _ in predict(FakeRequest(), f"prompt {i}"):
+                    pass
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                failures.append(str(e))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, failures, time.perf_counter() - started
+
+
+async def benchmark(args, urls, output_dir):
+    receiver = WebhookReceiver()
+    webhook_server, webhook_url = start_webhook_server(receiver)
+    # The warmup opens the pooled connections, its timings are left out by
+    # measuring with a fresh app and metrics on the same event loop
+    try:
+        predict = create_app(args, urls, Metrics(), output_dir, receiver, webhook_url)
+        await run_load(predict, args.warmup, args.concurrency)
+        metrics = Metrics()
+        predict = create_app(args, urls, metrics, output_dir, receiver, webhook_url)
+        return await run_load(predict, args.requests, args.concurrency), metrics
+    finally:
+        webhook_server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prediction path.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds each prediction takes."
+    )
+    parser.add_argument("--mode", choices=["sync", "async", "webhook"], default="sync")
+    parser.add_argument(
+        "--busy",
+        action="store_true",
+        help="Servers answer 409 while busy, like cog.",
+    )
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=None,
+        help="Admission limit, defaults to one per replica with --busy, none otherwise.",
+    )
+    parser.add_argument(
+        "--output_size",
+        type=int,
+        default=0,
+        help="Size in bytes of a data URI image output, 0 for a short string.",
+    )
+    parser.add_argument("--poll_interval_max", type=float, default=2.0)
+    parser.add_argument(
+        "--max_overhead_ms",
+        type=float,
+        default=None,
+        help="Fail when grog adds more than this many milliseconds per prediction.",
+    )
+    args = parser.parse_args()
+
+    processes, urls = start_fake_servers(args)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            # Per-prediction log lines would dominate the measurements
+            with contextlib.redirect_stdout(io.StringIO()):
+                (latencies, failures, elapsed), metrics = asyncio.run(
+                    benchmark(args, urls, output_dir)
+                )
+    finally:
+        for process in processes:
+            process.terminate()
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, {args.replicas} "
+        f"{args.mode} server(s){' (busy)' if args.busy else ''}, model latency "
+        f"{args.latency * 1000:.0f}ms, output {args.output_size} bytes"
+    )
+    if failures:
+        print(f"{len(failures)} failed, e.g. {failures[0]}")
+    if not latencies:
+        sys.exit(1)
+    print(f"throughput  {len(latencies) / elapsed:8.1f} predictions/s")
+    for name, fraction in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]:
+        print(f"{name}         {percentile(latencies, fraction) * 1000:8.1f}ms")
+    means = stage_means(metrics)
+    print("mean per stage:")
+    for stage, seconds in means.items():
+        print(f"  {stage:12} {seconds * 1000:8.2f}ms")
+    # Whatever is neither the model running nor waiting for a free backend
+    overhead = (
+        means.get("total", 0)
+        - means.get("inference", args.latency)
+        - means.get("queue", 0)
+    )
+    print(f"grog overhead {overhead * 1000:6.2f}ms per prediction")
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory   {peak_rss:6.1f}MB")
+
+    failed = bool(failures)
+    if args.max_overhead_ms is not None and overhead * 1000 > args.max_overhead_ms:
+        print(f"FAIL: overhead above the {args.max_overhead_ms}ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
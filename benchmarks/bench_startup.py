@@ -0,0 +1,98 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measures how long grog.py takes to start and which modules it imports, and
+# fails when the startup budget is exceeded or a heavy module gets imported:
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --budget_ms 800 -- \
+#       --replicate_model_id fofr/face-to-sticker --run_type replicate_api \
+#       --gradio_type static --replicate_token r8_... --offline
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time: self [us] | cumulative | imported package",
+    # nested imports are indented by two spaces per level
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(cumulative), depth))
+    return imports
+
+
+def run_grog(grog_args, cwd):
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(REPO_DIR, "grog.py")]
+        + grog_args,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if process.returncode != 0:
+        print(process.stderr[-2000:])
+        raise Exception(f"grog.py exited with {process.returncode}")
+    return elapsed, parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grog.py startup.")
+    parser.add_argument(
+        "grog_args",
+        nargs="*",
+        help="Arguments passed to grog.py after --, defaults to --help.",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget_ms",
+        type=int,
+        default=1000,
+        help="Fail when the best startup time is above this many milliseconds.",
+    )
+    parser.add_argument(
+        "--forbidden",
+        nargs="*",
+        default=["gradio", "prance", "huggingface_hub", "httpx"],
+        help="Fail when any of these modules is imported.",
+    )
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    grog_args = args.grog_args or ["--help"]
+
+    # Static generation writes files, keep them out of the repo
+    with tempfile.TemporaryDirectory() as cwd:
+        runs = [run_grog(grog_args, cwd) for _ in range(args.repeat)]
+    best, imports = min(runs, key=lambda run: run[0])
+
+    print(f"grog.py {' '.join(grog_args)}")
+    print(f"best {best * 1000:.0f}ms over {args.repeat} runs")
+    top_level = [(name, us) for name, us, depth in imports if depth == 0]
+    print("slowest top level imports:")
+    for name, cumulative in sorted(top_level, key=lambda i: -i[1])[: args.top]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failures = []
+    if best * 1000 > args.budget_ms:
+        failures.append(f"startup took {best * 1000:.0f}ms, budget {args.budget_ms}ms")
+    imported = {name.split(".")[0] for name, _, _ in imports}
+    for module in args.forbidden:
+        if module in imported:
+            failures.append(f"{module} was imported")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
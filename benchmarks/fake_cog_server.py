@@ -0,0 +1,245 @@
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for a cog server (or the Replicate API) to measure what grog adds
+# on top of the model, without Docker or a GPU:
+#
+#   python benchmarks/fake_cog_server.py --port 5000 --latency 0.5 --busy
+#
+# In sync mode predictions are answered when done (cog), in async mode with a
+# 201 and a urls.get to poll (Replicate). Like cog, PUT /predictions/{id} with
+# Prefer: respond-async answers a 202 and reports the prediction to its
+# webhook. With --busy a second concurrent prediction gets a 409, like cog
+# which runs one prediction at a time.
+
+
+def fake_output(output_size):
+    # Random bytes behind a PNG data URI, the output store writes them as is
+    if not output_size:
+        return "done"
+    encoded = base64.b64encode(os.urandom(output_size)).decode()
+    return f"data:image/png;base64,{encoded}"
+
+
+class FakeCog:
+    def __init__(
+        self, latency=0.0, mode="sync", busy=False, output_size=0, setup_time=0
+    ):
+        self.latency = latency
+        self.mode = mode
+        self.busy = busy
+        self.output = fake_output(output_size)
+        self.ready_at = time.monotonic() + setup_time
+        self.lock = threading.Lock()
+        self.running = 0
+        self.predictions = {}
+        self.timers = {}
+        self.served = 0
+        self.rejected = 0
+        self.canceled = 0
+
+    def start_prediction(self):
+        with self.lock:
+            if self.busy and self.running:
+                self.rejected += 1
+                return False
+            self.running += 1
+            return True
+
+    def run_in_background(self, prediction, webhook=None):
+        timer = threading.Timer(
+            self.latency, self.finish_prediction, args=(prediction, webhook)
+        )
+        with self.lock:
+            self.predictions[prediction["id"]] = prediction
+            self.timers[prediction["id"]] = timer
+        timer.start()
+
+    def finish_prediction(self, prediction, webhook=None, status="succeeded"):
+        with self.lock:
+            if prediction["status"] in ("succeeded", "canceled"):
+                return
+            self.timers.pop(prediction["id"], None)
+            self.running -= 1
+            self.served += 1
+            prediction["status"] = status
+            if status == "succeeded":
+                prediction["output"] = self.output
+                prediction["metrics"] = {"predict_time": self.latency}
+            prediction["completed_at"] = time.time()
+            finished = dict(prediction)
+        if webhook:
+            send_webhook(webhook, finished)
+
+    def cancel_prediction(self, prediction_id, webhook=None):
+        with self.lock:
+            prediction = self.predictions.get(prediction_id)
+            timer = self.timers.get(prediction_id)
+        if prediction is None:
+            return False
+        if timer is not None:
+            timer.cancel()
+            self.canceled += 1
+        self.finish_prediction(prediction, prediction.get("webhook"), "canceled")
+        return True
+
+
+def send_webhook(url, prediction):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(prediction).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except OSError as e:
+        print(f"Could not send the webhook to {url}: {e}")
+
+
+def create_handler(cog, base_url):
+    class FakeCogHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, without this every
+        # response waits for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length)) if length else {}
+
+        def do_GET(self):
+            if self.path == "/health-check":
+                if time.monotonic() < cog.ready_at:
+                    status = "STARTING"
+                else:
+                    status = "BUSY" if cog.busy and cog.running else "READY"
+                return self.send_json(200, {"status": status})
+            prediction_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+            with cog.lock:
+                prediction = dict(cog.predictions.get(prediction_id) or {})
+            if not prediction:
+                return self.send_json(404, {"detail": "Not found"})
+            self.send_json(200, prediction)
+
+        def do_POST(self):
+            body = self.read_json()
+            if self.path.endswith("/cancel"):
+                prediction_id = self.path.rstrip("/").rsplit("/", 2)[-2]
+                if not cog.cancel_prediction(prediction_id):
+                    return self.send_json(404, {"detail": "Not found"})
+                return self.send_json(200, {})
+            if self.path.rstrip("/") != "/predictions":
+                return self.send_json(404, {"detail": "Not found"})
+            if cog.mode == "async":
+                return self.create_prediction(uuid.uuid4().hex, body, 201)
+            self.create_prediction(uuid.uuid4().hex, body)
+
+        def do_PUT(self):
+            body = self.read_json()
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or parts[0] != "predictions":
+                return self.send_json(404, {"detail": "Not found"})
+            if "respond-async" in self.headers.get("Prefer", ""):
+                return self.create_prediction(parts[1], body, 202)
+            self.create_prediction(parts[1], body)
+
+        def create_prediction(self, prediction_id, body, async_status=None):
+            if not cog.start_prediction():
+                return self.send_json(409, {"detail": "Already running a prediction"})
+            prediction = {
+                "id": prediction_id,
+                "input": body.get("input", {}),
+                "status": "processing",
+                "output": None,
+                "webhook": body.get("webhook"),
+                "urls": {
+                    "get": f"{base_url}/predictions/{prediction_id}",
+                    "cancel": f"{base_url}/predictions/{prediction_id}/cancel",
+                },
+            }
+            if async_status is not None:
+                created = dict(prediction)
+                cog.run_in_background(prediction, body.get("webhook"))
+                return self.send_json(async_status, created)
+            time.sleep(cog.latency)
+            cog.finish_prediction(prediction)
+            self.send_json(200, prediction)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeCogHandler
+
+
+def start_fake_cog_server(port=0, hostname="127.0.0.1", **options):
+    # Serves in a background thread, returns the server and its predictions URL
+    cog = FakeCog(**options)
+    server = ThreadingHTTPServer((hostname, port), None)
+    server.daemon_threads = True
+    base_url = f"http://{hostname}:{server.server_address[1]}"
+    server.RequestHandlerClass = create_handler(cog, base_url)
+    server.cog = cog
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{base_url}/predictions"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake cog server.")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--hostname", default="127.0.0.1")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds each prediction takes."
+    )
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument(
+        "--busy",
+        action="store_true",
+        help="Answer 409 while a prediction is running, like cog.",
+    )
+    parser.add_argument(
+        "--output_size",
+        type=int,
+        default=0,
+        help="Size in bytes of a data URI image output, 0 for a short string.",
+    )
+    parser.add_argument(
+        "--setup_time",
+        type=float,
+        default=0,
+        help="Seconds the health check answers STARTING.",
+    )
+    args = parser.parse_args()
+    server, url = start_fake_cog_server(
+        args.port,
+        args.hostname,
+        latency=args.latency,
+        mode=args.mode,
+        busy=args.busy,
+        output_size=args.output_size,
+        setup_time=args.setup_time,
+    )
+    print(f"Fake cog server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
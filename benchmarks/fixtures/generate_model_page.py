@@ -0,0 +1,177 @@
+import argparse
+import json
+import random
+
+# Writes a model page shaped like the ones replicate.com serves for
+# ?input=docker&output=json: megabytes of markup and inline scripts around the
+# application/json script tag holding the model version and its example
+# prediction, which is what grog extracts:
+#
+#   python benchmarks/fixtures/generate_model_page.py page.html --size 5
+#
+# Content is derived from a fixed seed, so every run writes the same page.
+
+MODEL_ID = "fixture/synthetic-model"
+
+
+def input_schema(count):
+    properties = {
+        "prompt": {
+            "type": "string",
+            "title": "Prompt",
+            "x-order": 0,
+            "default": "a photo of an astronaut riding a horse",
+            "description": "Input prompt",
+        },
+        "image": {
+            "type": "string",
+            "title": "Image",
+            "format": "uri",
+            "x-order": 1,
+            "description": "Input image for img2img or inpaint mode",
+        },
+        "scheduler": {
+            "enum": ["DDIM", "K_EULER", "DPMSolverMultistep"],
+            "type": "string",
+            "title": "scheduler",
+            "x-order": 2,
+            "default": "K_EULER",
+            "description": "Scheduler",
+        },
+        "num_inference_steps": {
+            "type": "integer",
+            "title": "Num Inference Steps",
+            "x-order": 3,
+            "default": 30,
+            "minimum": 1,
+            "maximum": 500,
+        },
+        "guidance_scale": {
+            "type": "number",
+            "title": "Guidance Scale",
+            "x-order": 4,
+            "default": 7.5,
+            "minimum": 1,
+            "maximum": 50,
+        },
+        "disable_safety_checker": {
+            "type": "boolean",
+            "title": "Disable Safety Checker",
+            "x-order": 5,
+            "default": False,
+        },
+        "seed": {
+            "type": "integer",
+            "title": "Seed",
+            "x-order": 6,
+            "description": "Random seed. Leave blank to randomize the seed",
+        },
+    }
+    for i in range(len(properties), count):
+        properties[f"option_{i}"] = {
+            "type": "string",
+            "title": f"Option {i}",
+            "x-order": i,
+            "description": f"Advanced option {i}",
+        }
+    return properties
+
+
+def page_data(rng):
+    schema = {
+        "components": {
+            "schemas": {
+                "Input": {"type": "object", "properties": input_schema(40)},
+                "Output": {
+                    "type": "array",
+                    "items": {"type": "string", "format": "uri"},
+                },
+            }
+        }
+    }
+    version_id = "%064x" % rng.getrandbits(256)
+    return {
+        "version": {
+            "id": version_id,
+            "_extras": {
+                "docker_image_name": f"r8.im/{MODEL_ID}@sha256:{version_id}",
+                "dereferenced_openapi_schema": schema,
+                "model": {
+                    "name": MODEL_ID.split("/")[1],
+                    "owner": MODEL_ID.split("/")[0],
+                    "_extras": {
+                        "description": "A synthetic model page for benchmarks",
+                        "latest_enabled_version_id": version_id,
+                    },
+                },
+            },
+        },
+        "initialPrediction": {
+            "input": {
+                "prompt": "a photo of an astronaut riding a horse",
+                "image": "https://replicate.delivery/pbxt/input.png",
+                "num_inference_steps": 30,
+            },
+            "output": [
+                f"https://replicate.delivery/pbxt/{rng.getrandbits(64):x}/out-{i}.png"
+                for i in range(4)
+            ],
+        },
+    }
+
+
+def filler_block(rng, i):
+    # Markup, inline scripts and other JSON script tags, as on the real pages
+    words = " ".join(
+        rng.choice(["model", "image", "prompt", "replicate", "run", "api", "gpu"])
+        for _ in range(40)
+    )
+    state = json.dumps({"route": f"/explore/{i}", "items": list(range(30))})
+    return (
+        f'<div class="card" id="card-{i}"><h3>Example {i}</h3><p>{words}</p>'
+        f'<a href="/p/{rng.getrandbits(48):x}">Open</a></div>\n'
+        f"<script>window.__chunk_{i} = function (e) {{ return e + {i}; }};</script>\n"
+        f'<script type="application/json" id="state-{i}">{state}</script>\n'
+    )
+
+
+def generate_model_page(size=5 * 1024**2, seed=0):
+    rng = random.Random(seed)
+    head = (
+        "<!DOCTYPE html>\n<html><head><title>fixture/synthetic-model | Replicate</title>"
+        '<meta charset="utf-8"></head><body>\n'
+    )
+    data_tag = (
+        f'<script type="application/json" id="react-component-props">'
+        f"{json.dumps(page_data(rng))}</script>\n"
+    )
+    blocks = []
+    length = len(head) + len(data_tag)
+    i = 0
+    # The data sits two thirds down the page, past most of the markup
+    while length < size:
+        block = filler_block(rng, i)
+        blocks.append(block)
+        length += len(block)
+        i += 1
+    split = len(blocks) * 2 // 3
+    return (
+        head
+        + "".join(blocks[:split])
+        + data_tag
+        + "".join(blocks[split:])
+        + "</body></html>\n"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic model page.")
+    parser.add_argument("path")
+    parser.add_argument("--size", type=float, default=5, help="Size in MB.")
+    args = parser.parse_args()
+    with open(args.path, "w") as file:
+        file.write(generate_model_page(int(args.size * 1024**2)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,81 @@
 import argparse
+import atexit
 import sys
 import requests
 import os
 import time
 from urllib.parse import urlparse
-import subprocess
-import socket
 import re
+import json
 from utils.gradio_helpers import (
     build_gradio_inputs,
     build_gradio_outputs_replicate,
     create_dynamic_gradio_app,
+    create_gateway_app,
     create_gradio_app_script,
-    detect_file_type,
+    launch_gradio_app,
+    webhook_route,
+)
+from utils.admission import DEFAULT_MAX_QUEUE_SIZE, AdmissionQueue
+from utils.backend_pool import BackendPool
+from utils.container_helpers import (
+    pull_image_in_background,
+    run_docker_replicas,
+    stop_containers,
+)
+from utils.file_inputs import (
+    DEFAULT_INLINE_FILE_MAX_SIZE,
+    DEFAULT_LOCAL_INLINE_FILE_MAX_SIZE,
+    files_api_url,
+)
+from utils.idle_scaler import DEFAULT_IDLE_ACTION, IDLE_ACTIONS, IdleScaler
+from utils.preprocessing import load_preprocess_config
+from utils.ui_spec import detect_file_type
+from utils.metrics import metrics_route
+from utils.http_helpers import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_REQUEST_TIMEOUT,
+    get_session,
+)
+from utils.output_store import (
+    DEFAULT_OUTPUT_CACHE_SIZE,
+    DEFAULT_OUTPUT_DIR,
+    DEFAULT_OUTPUT_MAX_AGE,
+    OutputStore,
+)
+from utils.result_cache import (
+    DEFAULT_REPLICATE_RESULT_MAX_AGE,
+    DEFAULT_RESULT_CACHE_MAX_SIZE,
+    DEFAULT_RESULT_CACHE_SIZE,
+    DEFAULT_UNCACHEABLE_IF_EMPTY,
+    ResultCache,
+)
+from utils.prediction_helpers import (
+    COMPLETION_MODES,
+    DEFAULT_MAX_POLL_INTERVAL,
+    DEFAULT_PREDICTION_TIMEOUT,
+    WebhookReceiver,
+    fetch_webhook_secret,
+)
+from utils.metadata_cache import (
+    DEFAULT_METADATA_CACHE_DIR,
+    DEFAULT_METADATA_TTL,
+    is_fresh,
+    read_cached_metadata,
+    write_cached_metadata,
 )
-from prance import ResolvingParser
 from tempfile import NamedTemporaryFile
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import shutil
-from slugify import slugify
 
-
-def check_nvidia_gpu():
-    try:
-        subprocess.run(
-            ["nvidia-smi"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
-        )
-        return True
-    except subprocess.CalledProcessError:
-        return False
-    except FileNotFoundError:
-        return False
+REPLICATE_PREDICTIONS_URL = "https://api.replicate.com/v1/predictions"
+DOCKER_HELPER_FILES = ["Dockerfile", "requirements.txt", "run.sh"]
+DEFAULT_BATCH_WORKERS = 4
+JSON_SCRIPT_TAG_PATTERN = re.compile(
+    r"""<script\b[^>]*\btype=["']application/json["'][^>]*>""", re.IGNORECASE
+)
 
 
 def sort_properties_by_order(properties):
@@ -41,6 +86,8 @@ def sort_properties_by_order(properties):
 
 
 def parse_api_specs(schema_url):
+    from prance import ResolvingParser
+
     schema_response = requests.get(schema_url)
     openapi_spec = schema_response.content
 
@@ -65,96 +112,75 @@ def parse_docker_image_data(docker_uri):
         return None, None
 
 
-def wait_util_cog_ready(hostname, docker_port):
-    # check http://0.0.0.0:5000/health-check {"status": "READY"} or {"status":"STARTING","setup":null}
-    counter = 0
-    while True:
-        try:
-            response = requests.get(f"http://{hostname}:{docker_port}/health-check")
-            response.raise_for_status()
-            if response.json()["status"] == "READY":
-                print("Cog Server is ready.")
-                break
-            else:
-                print(f"Waiting for cog server (models loading) {docker_port}...")
-                counter += 1
-                time.sleep(5)
-                if counter >= 250:
-                    raise Exception("Docker image timeout")
-        except requests.exceptions.HTTPError as e:
-            raise Exception(f"HTTP Error occurred: {e}")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error fetching data: {e}")
-
-
-def wait_until_docker(hostname, docker_port):
-    counter = 0
-    while True:
-        try:
-            with socket.create_connection(
-                (hostname, int(docker_port)), timeout=1
-            ) as sock:
-                print("Cog Docker is ready.")
-                break  # Exit the loop when the server is up
-        except (socket.timeout, ConnectionRefusedError):
-            print(f"Waiting for cog docker to start on port {docker_port}...")
-            counter += 1
-            time.sleep(5)
-            if counter >= 250:
-                raise Exception("Docker image timeout")
-
-
-def run_docker_container(docker_image, hostname, local_port):
-    docker_command = [
-        "docker",
-        "run",
-        "-d",
-        "-h",
-        hostname,
-        "--net",
-        "host",
-        "-p",
-        f"{local_port}:5000",
-    ]
-    is_nvidia_gpu_available = check_nvidia_gpu()
-    if is_nvidia_gpu_available:
-        docker_command.append("--gpus=all")
-
-    docker_command.append(docker_image)
-    process = subprocess.Popen(docker_command)
-
-    wait_until_docker(hostname, local_port)
-
-
-def process_replicate_model_data(model_id):
-    import requests
-    from bs4 import BeautifulSoup
-    import json
-
+def fetch_replicate_model_page(model_id, etag=None):
+    # Returns (None, etag) when the page didn't change since etag
+    headers = {"If-None-Match": etag} if etag else {}
     try:
         url = f"https://replicate.com/{model_id}?input=docker&output=json"
-        response = requests.get(url)
+        response = requests.get(url, headers=headers)
+        if response.status_code == 304:
+            return None, etag
         response.raise_for_status()
-        html_content = response.text
+        return response.text, response.headers.get("ETag")
     except requests.exceptions.HTTPError as e:
         raise Exception(f"HTTP Error occurred: {e}")
     except requests.exceptions.RequestException as e:
         raise Exception(f"Error fetching data: {e}")
 
+
+def process_replicate_model_data(
+    model_id,
+    cache_dir=DEFAULT_METADATA_CACHE_DIR,
+    ttl=DEFAULT_METADATA_TTL,
+    offline=False,
+):
+    if not cache_dir:
+        html_content, _ = fetch_replicate_model_page(model_id)
+        return parse_replicate_model_page(html_content)
+
+    entry = read_cached_metadata(model_id, cache_dir)
+    if entry is not None and (offline or is_fresh(entry, ttl)):
+        return entry["model_data"]
+    if offline:
+        raise Exception(
+            f"No cached metadata for {model_id} in {cache_dir}, run once without --offline"
+        )
     try:
-        soup = BeautifulSoup(html_content, "html.parser")
-        script_tags = soup.find_all("script", {"type": "application/json"})
-        data = None
-        for script_tag in script_tags:
-          if("initialPrediction" in script_tag.string):
-            json_str = script_tag.string
-            data = json.loads(json_str)
+        html_content, etag = fetch_replicate_model_page(
+            model_id, entry["etag"] if entry else None
+        )
+    except Exception as e:
+        if entry is None:
+            raise
+        print(f"Could not refresh metadata for {model_id}, using cached copy: {e}")
+        return entry["model_data"]
+    if html_content is None:
+        model_data = entry["model_data"]
+    else:
+        model_data = parse_replicate_model_page(html_content)
+    write_cached_metadata(model_id, model_data, etag, cache_dir)
+    return model_data
+
+
+def extract_initial_prediction_data(html_content):
+    # Scan the page for its JSON script tags instead of building a DOM of the
+    # whole page, script contents are raw text so they can be sliced out as is
+    for match in JSON_SCRIPT_TAG_PATTERN.finditer(html_content):
+        start = match.end()
+        end = html_content.find("</script>", start)
+        if end == -1:
             break
-        if data is None:
-          raise ValueError("Data with 'initialPrediction' not found in the HTML content.")
+        if html_content.find("initialPrediction", start, end) != -1:
+            return json.loads(html_content[start:end])
+    raise ValueError("Data with 'initialPrediction' not found in the HTML content.")
+
+
+def parse_replicate_model_page(html_content):
+    try:
+        data = extract_initial_prediction_data(html_content)
     except Exception as e:
         raise Exception(f"Failed to process model data: {str(e)}")
-    
+
     if data["initialPrediction"] is not None:
         if isinstance(data["initialPrediction"]["output"], str):
             output_types = [detect_file_type(data["initialPrediction"]["output"])]
@@ -169,9 +195,20 @@ def process_replicate_model_data(model_id):
             output_types = ["json"]
     else:
         output_types = None
+    # Iterator outputs displayed concatenated (e.g. LLM tokens) stream into one textbox
+    output_schema = data["version"]["_extras"]["dereferenced_openapi_schema"][
+        "components"
+    ]["schemas"].get("Output", {})
+    output_concatenate = (
+        output_schema.get("x-cog-array-type") == "iterator"
+        and output_schema.get("x-cog-array-display") == "concatenate"
+    )
+    if output_concatenate:
+        output_types = ["string"]
     result = {
         "docker_image_url": data["version"]["_extras"]["docker_image_name"],
         "output_types": output_types,
+        "output_concatenate": output_concatenate,
         "ordered_input_schema": sort_properties_by_order(
             data["version"]["_extras"]["dereferenced_openapi_schema"]["components"][
                 "schemas"
@@ -253,6 +290,47 @@ def create_parser():
         help="The port to mount the docker application (default 5000).",
         default=5000,
     )
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        help="Number of cog containers to run and balance predictions over, on consecutive ports from --docker_port, one GPU each when available (default 1).",
+        default=1,
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Run a prediction with the model's example inputs on each new cog container before accepting traffic.",
+    )
+    parser.add_argument(
+        "--stop_containers",
+        action="store_true",
+        help="Stop the cog containers on exit instead of leaving them running to be reused by the next run.",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        help="Stop the cog containers after this many seconds without predictions and start them again on the next one, 0 to keep them running (default 0).",
+        default=0,
+    )
+    parser.add_argument(
+        "--idle_action",
+        type=str,
+        choices=IDLE_ACTIONS,
+        help="How --idle_timeout puts containers to sleep: stop frees the GPU memory but the model sets up again on wake, pause wakes instantly but keeps the memory (default stop).",
+        default=DEFAULT_IDLE_ACTION,
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        help="Predictions sent to the backend at once, the others wait in a FIFO queue; 0 for no limit (default: one per cog replica, no limit for replicate_api).",
+        default=None,
+    )
+    parser.add_argument(
+        "--max_queue_size",
+        type=int,
+        help=f"Requests waiting for the backend above which new ones are refused, 0 for no limit (default {DEFAULT_MAX_QUEUE_SIZE}).",
+        default=DEFAULT_MAX_QUEUE_SIZE,
+    )
     parser.add_argument(
         "--space_hardware",
         type=str,
@@ -265,6 +343,161 @@ def create_parser():
         help="If you want a repo for your Hugging Face Space different than the name of the cog model",
         default=None,
     )
+    parser.add_argument(
+        "--pool_size",
+        type=int,
+        help="Number of keep-alive connections kept per backend (default 10).",
+        default=DEFAULT_POOL_SIZE,
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        help="Retries with backoff for failed connections and polls (default 3).",
+        default=DEFAULT_MAX_RETRIES,
+    )
+    parser.add_argument(
+        "--request_timeout",
+        type=float,
+        help="Timeout in seconds for each request to the backend (default 600).",
+        default=DEFAULT_REQUEST_TIMEOUT,
+    )
+    parser.add_argument(
+        "--poll_interval_max",
+        type=float,
+        help="Upper bound in seconds for the backoff between status polls (default 2).",
+        default=DEFAULT_MAX_POLL_INTERVAL,
+    )
+    parser.add_argument(
+        "--prediction_timeout",
+        type=float,
+        help="Give up (and cancel) a prediction after this many seconds (default 1800).",
+        default=DEFAULT_PREDICTION_TIMEOUT,
+    )
+    parser.add_argument(
+        "--completion_mode",
+        type=str,
+        choices=COMPLETION_MODES,
+        help="How the Replicate API reports finished predictions: poll it, receive a webhook on the Gradio server or follow its server-sent events stream (default poll). With --run_type local, webhook submits predictions to cog asynchronously so they can be canceled, poll waits on the request (default webhook).",
+        default=None,
+    )
+    parser.add_argument(
+        "--webhook_url",
+        type=str,
+        help="Public URL Replicate should send webhooks to (defaults to the Gradio app URL + /grog/webhook).",
+        default=None,
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        help="Directory where decoded audio/video/image outputs are cached, e.g. a tmpfs mount (default: <tmp>/grog_outputs).",
+        default=DEFAULT_OUTPUT_DIR,
+    )
+    parser.add_argument(
+        "--output_cache_size",
+        type=int,
+        help="Maximum size of the output directory in MB before the least recently used files are deleted (default 2048).",
+        default=DEFAULT_OUTPUT_CACHE_SIZE // 1024**2,
+    )
+    parser.add_argument(
+        "--output_max_age",
+        type=int,
+        help="Seconds after which unused output files are deleted, 0 to keep them (default 86400).",
+        default=DEFAULT_OUTPUT_MAX_AGE,
+    )
+    parser.add_argument(
+        "--inline_file_max_size",
+        type=float,
+        help="Size in MB up to which uploaded files are sent inside the prediction request as data URIs (default: 1 for replicate_api, 25 for local).",
+        default=None,
+    )
+    parser.add_argument(
+        "--preprocess",
+        type=str,
+        help='JSON, or a JSON file, with preprocessing applied to uploaded files by input name or file kind, e.g. \'{"image": {"max_size": 1024, "format": "JPEG"}}\'.',
+        default=None,
+    )
+    parser.add_argument(
+        "--result_cache",
+        action="store_true",
+        help="Reuse the output of previous predictions with the same inputs and model version (dynamic apps only).",
+    )
+    parser.add_argument(
+        "--result_cache_size",
+        type=int,
+        help="Number of prediction results kept in memory by --result_cache (default 256).",
+        default=DEFAULT_RESULT_CACHE_SIZE,
+    )
+    parser.add_argument(
+        "--result_cache_max_size",
+        type=int,
+        help="Maximum size in MB of the results kept in memory by --result_cache (default 64).",
+        default=DEFAULT_RESULT_CACHE_MAX_SIZE // 1024**2,
+    )
+    parser.add_argument(
+        "--result_cache_max_age",
+        type=int,
+        help="Seconds after which --result_cache entries expire, 0 to keep them (default: 3000 for replicate_api, whose output URLs expire after an hour, 0 for local).",
+        default=None,
+    )
+    parser.add_argument(
+        "--result_cache_dir",
+        type=str,
+        help="Also persist --result_cache entries to this directory, so they survive restarts.",
+        default=None,
+    )
+    parser.add_argument(
+        "--uncacheable_if_empty",
+        type=str,
+        nargs="*",
+        help="Inputs that make a prediction non-cacheable when left empty, e.g. a random seed (default: seed).",
+        default=DEFAULT_UNCACHEABLE_IF_EMPTY,
+    )
+    parser.add_argument(
+        "--coalesce_requests",
+        action="store_true",
+        help="Let concurrent predictions with identical inputs share a single upstream prediction (dynamic apps only).",
+    )
+    parser.add_argument(
+        "--metadata_cache_dir",
+        type=str,
+        help="Directory where model metadata scraped from replicate.com is cached, empty to disable (default: ~/.cache/grog/models).",
+        default=DEFAULT_METADATA_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--metadata_ttl",
+        type=int,
+        help="Seconds cached model metadata is used without revalidating it with replicate.com (default 86400).",
+        default=DEFAULT_METADATA_TTL,
+    )
+    parser.add_argument(
+        "--model_ids",
+        type=str,
+        nargs="+",
+        help="Several Replicate models, generated at once as static apps or Spaces, or served as tabs of one dynamic app.",
+        default=None,
+    )
+    parser.add_argument(
+        "--model_manifest",
+        type=str,
+        help="File with one Replicate model ID per line to generate in batch or serve from one app ('#' starts a comment).",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch_workers",
+        type=int,
+        help=f"Number of models generated, or started for a multi-model app, concurrently (default {DEFAULT_BATCH_WORKERS}).",
+        default=DEFAULT_BATCH_WORKERS,
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached model metadata, never contact replicate.com for it.",
+    )
+    parser.add_argument(
+        "--json_logs",
+        action="store_true",
+        help="Log one JSON line with the per-stage timings of every prediction.",
+    )
     return parser
 
 
@@ -279,6 +512,37 @@ def check_conditional_args(args):
             "Error: --huggingface_token is required when run_type is 'huggingface_spaces'"
         )
 
+    local_dynamic = args.run_type == "local" and args.gradio_type == "dynamic"
+    if args.completion_mode is None:
+        # cog's async API lets a canceled prediction free the GPU right away
+        args.completion_mode = "webhook" if local_dynamic else "poll"
+    if args.completion_mode == "webhook" and not (
+        args.run_type == "replicate_api" or local_dynamic
+    ):
+        sys.exit(
+            "Error: --completion_mode webhook is only available with --run_type replicate_api, or local and --gradio_type dynamic"
+        )
+    if args.completion_mode == "stream" and args.run_type != "replicate_api":
+        sys.exit(
+            "Error: --completion_mode stream is only available with --run_type replicate_api"
+        )
+
+    if args.replicas < 1:
+        sys.exit("Error: --replicas must be at least 1")
+    if args.replicas > 1 and not local_dynamic:
+        sys.exit(
+            "Error: --replicas is only available with --run_type local and --gradio_type dynamic"
+        )
+    if args.idle_timeout and not local_dynamic:
+        sys.exit(
+            "Error: --idle_timeout is only available with --run_type local and --gradio_type dynamic"
+        )
+
+    if args.model_ids or args.model_manifest:
+        if args.space_repo:
+            sys.exit("Error: --space_repo can't be used in batch mode")
+        return
+
     # Ensure either cog_url or replicate_model_id is provided
     if not args.cog_url and not args.replicate_model_id:
         sys.exit("Error: Either --cog_url or --replicate_model_id must be provided.")
@@ -294,146 +558,455 @@ def check_conditional_args(args):
         )
 
 
+def file_input_settings(args, api_url):
+    # Larger files are uploaded to Replicate, or fetched by the local cog
+    # server from the Gradio app
+    if args.inline_file_max_size is not None:
+        inline_file_max_size = int(args.inline_file_max_size * 1024**2)
+    elif args.run_type == "replicate_api":
+        inline_file_max_size = DEFAULT_INLINE_FILE_MAX_SIZE
+    else:
+        inline_file_max_size = DEFAULT_LOCAL_INLINE_FILE_MAX_SIZE
+    files_url = files_api_url(api_url) if args.run_type == "replicate_api" else None
+    return {
+        "inline_file_max_size": inline_file_max_size,
+        "files_url": files_url,
+        "preprocess_config": load_preprocess_config(args.preprocess),
+    }
+
+
+def read_model_ids(args):
+    model_ids = list(args.model_ids or [])
+    if args.model_manifest:
+        with open(args.model_manifest, "r") as file:
+            for line in file:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    model_ids.append(line)
+    return model_ids
+
+
+def read_docker_helpers(args, helpers_dir="docker_helpers"):
+    # Read once, every generated folder of a batch is written from memory
+    docker_helpers = {}
+    if args.run_type == "replicate_api":
+        return docker_helpers
+    for file_name in DOCKER_HELPER_FILES:
+        path = os.path.join(helpers_dir, file_name)
+        with open(path, "r") as file:
+            docker_helpers[file_name] = (file.read(), os.stat(path).st_mode)
+    return docker_helpers
+
+
+def write_docker_folder(dir_name, docker_image, docker_helpers, app_string):
+    os.makedirs(dir_name)
+    for file_name, (content, mode) in docker_helpers.items():
+        if file_name == "Dockerfile":
+            content = f"FROM {docker_image}\n" + content
+        with open(f"{dir_name}/{file_name}", "w") as file:
+            file.write(content)
+        os.chmod(f"{dir_name}/{file_name}", mode)
+    shutil.copytree(
+        "utils",
+        f"{dir_name}/utils",
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    with open(f"{dir_name}/app.py", "w") as file:
+        file.write(app_string)
+
+
+def upload_to_huggingface_spaces(args, dir_name, model_name):
+    print("Uploading to Hugging Face...")
+    from huggingface_hub import HfApi
+    from slugify import slugify
+
+    api = HfApi(token=args.huggingface_token)
+    try:
+        space_id = api.create_repo(
+            repo_id=(args.space_repo if args.space_repo else slugify(model_name)),
+            repo_type="space",
+            exist_ok=True,
+            space_sdk="docker",
+            space_hardware=args.space_hardware,
+            private=True,
+        )
+    except:
+        raise Exception("Something went wrong with HF repo creation")
+    parts = space_id.split("/")
+    space_nicename = "/".join(parts[-2:])
+    print(space_nicename)
+    try:
+        api.upload_folder(
+            repo_id=space_nicename,
+            folder_path=f"{dir_name}",
+            repo_type="space",
+        )
+    except:
+        raise Exception("Something went wrong with HF repo uploading")
+    print(f"Uploaded to Hugging Face. Access it at {space_id}")
+    shutil.rmtree(dir_name)
+    return space_id
+
+
+def generate_static_app(args, model_id, docker_helpers):
+    # Writes the editable app for one model and returns where it went
+    data = process_replicate_model_data(
+        model_id,
+        cache_dir=args.metadata_cache_dir,
+        ttl=args.metadata_ttl,
+        offline=args.offline,
+    )
+    _, inputs_string, _ = build_gradio_inputs(
+        data["ordered_input_schema"], data["example_inputs"], build_components=False
+    )
+    _, outputs_string = build_gradio_outputs_replicate(
+        data["output_types"], build_components=False
+    )
+    model_name = data["model_name"]
+    if args.run_type == "replicate_api":
+        api_url = REPLICATE_PREDICTIONS_URL
+        api_id = data["api_id"]
+    else:
+        api_url = f"http://{args.hostname}:5000/predictions"
+        api_id = None
+
+    app_string = create_gradio_app_script(
+        inputs_string,
+        outputs_string,
+        api_url=api_url,
+        api_id=api_id,
+        replicate_token=args.replicate_token,
+        title=f"Demo for {model_name} cog image by {data['model_author']}",
+        model_description=data["model_description"],
+        local_base=args.run_type == "huggingface_spaces",
+        hostname=args.hostname,
+        pool_size=args.pool_size,
+        max_retries=args.max_retries,
+        request_timeout=args.request_timeout,
+        poll_interval_max=args.poll_interval_max,
+        prediction_timeout=args.prediction_timeout,
+        completion_mode=args.completion_mode,
+        webhook_url=args.webhook_url,
+        concatenate_outputs=data["output_concatenate"],
+        output_dir=args.output_dir,
+        output_cache_size=args.output_cache_size * 1024**2,
+        output_max_age=args.output_max_age,
+        **file_input_settings(args, api_url),
+        model_id=model_id,
+        json_logs=args.json_logs,
+    )
+
+    # Models of different owners can share a name, e.g. in a batch
+    model_slug = model_id.replace("/", "--")
+    if args.run_type == "replicate_api":
+        app_file = f"app_{model_slug}_{int(datetime.now().timestamp())}.py"
+        with open(app_file, "w") as file:
+            file.write(app_string)
+        print(
+            f"\n{app_file} created. Use it with\n\npython {app_file}\n\nBe careful, your replicate API is in this file in plain text!\n"
+        )
+        return app_file
+
+    dir_name = f"docker_{model_slug}_{int(datetime.now().timestamp())}"
+    write_docker_folder(dir_name, data["docker_image_url"], docker_helpers, app_string)
+    print(
+        f"Folder {dir_name} created. You can build your Dockerfile or modify the Gradio app.py"
+    )
+    if args.run_type == "huggingface_spaces":
+        return upload_to_huggingface_spaces(args, dir_name, model_name)
+    return dir_name
+
+
+def run_batch(args, model_ids):
+    model_ids = list(dict.fromkeys(model_ids))
+    docker_helpers = read_docker_helpers(args)
+
+    def generate(model_id):
+        started = time.monotonic()
+        try:
+            result = generate_static_app(args, model_id, docker_helpers)
+            failed = False
+        except Exception as e:
+            result = str(e)
+            failed = True
+        return model_id, failed, result, time.monotonic() - started
+
+    # Metadata fetches and Space uploads are network bound, a failing model
+    # is reported at the end instead of aborting the others
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.batch_workers) as executor:
+        results = list(executor.map(generate, model_ids))
+
+    print(f"\nGenerated {len(model_ids)} models in {time.monotonic() - started:.1f}s")
+    for model_id, failed, result, elapsed in results:
+        print(f"{'FAILED' if failed else 'OK':6} {elapsed:6.1f}s  {model_id}: {result}")
+    failures = [result for result in results if result[1]]
+    if failures:
+        sys.exit(f"Error: {len(failures)} of {len(model_ids)} models failed")
+
+
+def load_model(args, model_id):
+    data = process_replicate_model_data(
+        model_id,
+        cache_dir=args.metadata_cache_dir,
+        ttl=args.metadata_ttl,
+        offline=args.offline,
+    )
+    # The multi-GB download overlaps with building the Gradio app
+    pull = None
+    if args.run_type == "local":
+        pull = pull_image_in_background(data["docker_image_url"])
+    return data, pull
+
+
+def start_model_backend(args, data, pull, docker_port):
+    # Returns the prediction URL, with replicas the pool balancing over them and
+    # with --idle_timeout what puts the containers to sleep
+    if args.run_type == "replicate_api":
+        return REPLICATE_PREDICTIONS_URL, None, None
+    api_urls, container_ids = run_docker_replicas(
+        data["docker_image_url"],
+        args.hostname,
+        docker_port,
+        args.replicas,
+        pull=pull,
+        warmup_inputs=data["example_inputs"] if args.warmup else None,
+    )
+    # Left running by default, so the next run reuses the warm containers
+    if args.stop_containers:
+        atexit.register(stop_containers, container_ids)
+    # TODO for args.cog_url
+    # if (args.cog_url) and not args.replicate_model_id:
+    #    api_spec = parse_api_specs(
+    #        f"http://localhost:{args.docker_port}/openapi.json"
+    #    )
+    #    ordered_input_schema = sort_properties_by_order(
+    #        api_spec["components"]["schemas"]["Input"]["properties"]
+    #    )
+    #    inputs, inputs_string, names = build_gradio_inputs(ordered_input_schema)
+    #    outputs TODO
+    backend_pool = BackendPool(api_urls) if len(api_urls) > 1 else None
+    idle_scaler = None
+    if args.idle_timeout:
+        idle_scaler = IdleScaler(
+            container_ids,
+            args.hostname,
+            [urlparse(url).port for url in api_urls],
+            args.idle_timeout,
+            action=args.idle_action,
+        )
+    return api_urls[0], backend_pool, idle_scaler
+
+
+def create_webhook_receiver(args):
+    if args.completion_mode != "webhook":
+        return None
+    # cog doesn't sign its webhooks
+    webhook_secret = None
+    if args.run_type == "replicate_api":
+        webhook_secret = fetch_webhook_secret(
+            get_session(REPLICATE_PREDICTIONS_URL, args.pool_size, args.max_retries),
+            REPLICATE_PREDICTIONS_URL,
+            {"Authorization": f"Token {args.replicate_token}"},
+            request_timeout=args.request_timeout,
+        )
+        if webhook_secret is None:
+            # Unverified webhooks would let anyone forge predictions
+            print("Falling back to --completion_mode poll")
+            args.completion_mode = "poll"
+            return None
+    return WebhookReceiver(secret=webhook_secret)
+
+
+def create_model_app(
+    args,
+    model_id,
+    data,
+    ui,
+    api_url,
+    backend_pool=None,
+    webhook_receiver=None,
+    output_store=None,
+    idle_scaler=None,
+):
+    inputs, outputs, names = ui
+    api_id = data["api_id"] if args.run_type == "replicate_api" else None
+    # A cog server runs a single prediction at a time
+    max_concurrency = args.max_concurrency
+    if max_concurrency is None:
+        max_concurrency = 0 if args.run_type == "replicate_api" else args.replicas
+    admission_queue = None
+    if max_concurrency:
+        admission_queue = AdmissionQueue(max_concurrency, args.max_queue_size)
+
+    result_cache = None
+    result_cache_max_age = args.result_cache_max_age
+    if result_cache_max_age is None:
+        result_cache_max_age = (
+            DEFAULT_REPLICATE_RESULT_MAX_AGE if args.run_type == "replicate_api" else 0
+        )
+    if args.result_cache:
+        result_cache = ResultCache(
+            api_id or data["docker_image_url"],
+            max_entries=args.result_cache_size,
+            directory=args.result_cache_dir,
+            uncacheable_if_empty=args.uncacheable_if_empty,
+            max_size=args.result_cache_max_size * 1024**2,
+            max_age=result_cache_max_age,
+        )
+    return create_dynamic_gradio_app(
+        inputs,
+        outputs,
+        api_url=api_url,
+        api_id=api_id,
+        replicate_token=args.replicate_token,
+        title=f"Demo for {data['model_name']} cog image by {data['model_author']}",
+        model_description=data["model_description"],
+        names=names,
+        hostname=args.hostname,
+        pool_size=args.pool_size,
+        max_retries=args.max_retries,
+        request_timeout=args.request_timeout,
+        poll_interval_max=args.poll_interval_max,
+        prediction_timeout=args.prediction_timeout,
+        completion_mode=args.completion_mode,
+        webhook_receiver=webhook_receiver,
+        webhook_url=args.webhook_url,
+        concatenate_outputs=data["output_concatenate"],
+        output_store=output_store
+        or OutputStore(
+            args.output_dir,
+            max_size=args.output_cache_size * 1024**2,
+            max_age=args.output_max_age,
+        ),
+        result_cache=result_cache,
+        coalesce_requests=args.coalesce_requests,
+        backend_pool=backend_pool,
+        admission_queue=admission_queue,
+        **file_input_settings(args, api_url),
+        model_id=model_id,
+        json_logs=args.json_logs,
+        cog_async=args.run_type == "local" and args.completion_mode == "webhook",
+        idle_scaler=idle_scaler,
+    )
+
+
+def build_model_ui(data):
+    inputs, _, names = build_gradio_inputs(
+        data["ordered_input_schema"], data["example_inputs"]
+    )
+    outputs, _ = build_gradio_outputs_replicate(data["output_types"])
+    return inputs, outputs, names
+
+
+def run_gateway(args, model_ids):
+    # One Gradio server and share link with a tab per model. The models share
+    # the connection pools, the output store, the webhook receiver and the
+    # metrics, each keeps its own backend, queue and result cache
+    def start(index, model_id):
+        started = time.monotonic()
+        try:
+            data, pull = load_model(args, model_id)
+            # Each model gets its own range of --replicas ports
+            api_url, backend_pool, idle_scaler = start_model_backend(
+                args, data, pull, args.docker_port + index * args.replicas
+            )
+            result = (data, api_url, backend_pool, idle_scaler)
+        except Exception as e:
+            result = str(e)
+        return model_id, result, time.monotonic() - started
+
+    model_ids = list(dict.fromkeys(model_ids))
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.batch_workers) as executor:
+        results = list(executor.map(start, range(len(model_ids)), model_ids))
+
+    print(f"\nStarted {len(model_ids)} models in {time.monotonic() - started:.1f}s")
+    models = []
+    for model_id, result, elapsed in results:
+        failed = isinstance(result, str)
+        print(
+            f"{'FAILED' if failed else 'OK':6} {elapsed:6.1f}s  {model_id}: "
+            f"{result if failed else result[1]}"
+        )
+        if not failed:
+            models.append((model_id, *result))
+    if not models:
+        sys.exit("Error: none of the models could be started")
+
+    webhook_receiver = create_webhook_receiver(args)
+    output_store = OutputStore(
+        args.output_dir,
+        max_size=args.output_cache_size * 1024**2,
+        max_age=args.output_max_age,
+    )
+    apps = [
+        create_model_app(
+            args,
+            model_id,
+            data,
+            build_model_ui(data),
+            api_url,
+            backend_pool=backend_pool,
+            webhook_receiver=webhook_receiver,
+            output_store=output_store,
+            idle_scaler=idle_scaler,
+        )
+        for model_id, data, api_url, backend_pool, idle_scaler in models
+    ]
+    routes = [metrics_route()]
+    if webhook_receiver is not None:
+        routes.append(webhook_route(webhook_receiver))
+    app = create_gateway_app(apps, [model[0] for model in models])
+    launch_gradio_app(app, routes=routes, share=True)
+
+
 def main():
     parser = create_parser()
     args = parser.parse_args()
     check_conditional_args(args)
 
-    docker_port = str(args.docker_port)
-    hostname = args.hostname
-    api_id = None
-    if args.replicate_model_id:
-        data = process_replicate_model_data(args.replicate_model_id)
-        inputs, inputs_string, names = build_gradio_inputs(
-            data["ordered_input_schema"], data["example_inputs"]
-        )
-        outputs, outputs_string = build_gradio_outputs_replicate(data["output_types"])
-        model_name = data["model_name"]
-        model_author = data["model_author"]
-        title = f"Demo for {model_name} cog image by {data['model_author']}"
-        docker_image = data["docker_image_url"]
-        model_description = data["model_description"]
+    # Static apps only need the source of the components, which skips importing gradio
+    static = args.gradio_type == "static" or args.run_type == "huggingface_spaces"
+    model_ids = read_model_ids(args)
+    if model_ids:
+        if static:
+            run_batch(args, model_ids)
+        else:
+            run_gateway(args, model_ids)
+        return
+
+    if static:
+        generate_static_app(args, args.replicate_model_id, read_docker_helpers(args))
+        return
+
+    data, pull = load_model(args, args.replicate_model_id)
+    ui = build_model_ui(data)
     # TODO for args.cog_url
     # else:
     #    docker_image = args.cog_url
     #    model_name, model_author = parse_docker_image_data(docker_image)
     #    title = f"Demo for {model_name} cog image by {model_author}"
     #    model_description = ""
+    api_url, backend_pool, idle_scaler = start_model_backend(
+        args, data, pull, args.docker_port
+    )
 
-    if args.run_type == "replicate_api":
-        api_url = "https://api.replicate.com/v1/predictions"
-        api_id = data["api_id"]
-    else:
-        if args.run_type == "local" and args.gradio_type == "dynamic":
-            api_url = f"http://{hostname}:{docker_port}/predictions"
-            run_docker_container(docker_image, hostname, docker_port)
-            wait_util_cog_ready(hostname, docker_port)
-            # TODO for args.cog_url
-            # if (args.cog_url) and not args.replicate_model_id:
-            #    api_spec = parse_api_specs(
-            #        f"http://localhost:{docker_port}/openapi.json"
-            #    )
-            #    ordered_input_schema = sort_properties_by_order(
-            #        api_spec["components"]["schemas"]["Input"]["properties"]
-            #    )
-            #    inputs, inputs_string, names = build_gradio_inputs(ordered_input_schema)
-            #    outputs TODO
-        else:
-            api_url = f"http://{hostname}:5000/predictions"
-
-    if args.gradio_type == "dynamic" and not (args.run_type == "huggingface_spaces"):
-        app = create_dynamic_gradio_app(
-            inputs,
-            outputs,
-            api_url=api_url,
-            api_id=api_id,
-            replicate_token=args.replicate_token,
-            title=title,
-            model_description=model_description,
-            names=names,
-            hostname=hostname,
-        )
-        app.launch(share=True)
-    else:
-        app_string = create_gradio_app_script(
-            inputs_string,
-            outputs_string,
-            api_url=api_url,
-            api_id=api_id,
-            replicate_token=args.replicate_token,
-            title=title,
-            model_description=model_description,
-            local_base=(
-                True
-                if (args.run_type == "local" and args.gradio_type == "dynamic")
-                or args.run_type == "huggingface_spaces"
-                else False
-            ),
-            hostname=hostname,
-        )
-
-        if args.run_type == "local" or args.run_type == "huggingface_spaces":
-            app_file = "app.py"
-            dir_name = f"docker_{model_name}_{int(datetime.now().timestamp())}"
-            os.makedirs(f"{dir_name}/utils")
-            with open("docker_helpers/Dockerfile", "r") as file:
-                docker_file_content = file.read()
-            with open(f"{dir_name}/Dockerfile", "w") as file:
-                dockerfile_image_data = f"FROM {docker_image}\n"
-                file.write(dockerfile_image_data + docker_file_content)
-            shutil.copy(
-                "docker_helpers/requirements.txt", f"{dir_name}/requirements.txt"
-            )
-            shutil.copy("docker_helpers/run.sh", f"{dir_name}/run.sh")
-            shutil.copy(
-                "utils/gradio_helpers.py", f"{dir_name}/utils/gradio_helpers.py"
-            )
-            # Opening the file in write mode and writing the string
-            with open(f"{dir_name}/{app_file}", "w") as file:
-                file.write(app_string)
-            print(
-                f"Folder {dir_name} created. You can build your Dockerfile or modify the Gradio app.py"
-            )
-
-            if args.run_type == "huggingface_spaces":
-                print("Uploading to Hugging Face...")
-                from huggingface_hub import HfApi
-
-                api = HfApi(token=args.huggingface_token)
-                try:
-                    space_id = api.create_repo(
-                        repo_id=(
-                            args.space_repo if args.space_repo else slugify(model_name)
-                        ),
-                        repo_type="space",
-                        exist_ok=True,
-                        space_sdk="docker",
-                        space_hardware=args.space_hardware,
-                        private=True,
-                    )
-                except:
-                    raise Exception("Something went wrong with HF repo creation")
-                parts = space_id.split("/")
-                space_nicename = "/".join(parts[-2:])
-                print(space_nicename)
-                try:
-                    api.upload_folder(
-                        repo_id=space_nicename,
-                        folder_path=f"{dir_name}",
-                        repo_type="space",
-                    )
-                except:
-                    raise Exception("Something went wrong with HF repo uploading")
-                print(f"Uploaded to Hugging Face. Access it at {space_id}")
-                shutil.rmtree(dir_name)
-
-        elif args.run_type == "replicate_api":
-            app_file = f"app_{model_name}_{int(datetime.now().timestamp())}.py"
-            with open(app_file, "w") as file:
-                file.write(app_string)
-            print(
-                f"\n{app_file} created. Use it with\n\npython {app_file}\n\nBe careful, your replicate API is in this file in plain text!\n"
-            )
+    webhook_receiver = create_webhook_receiver(args)
+    routes = [metrics_route()]
+    if webhook_receiver is not None:
+        routes.append(webhook_route(webhook_receiver))
+    app = create_model_app(
+        args,
+        args.replicate_model_id,
+        data,
+        ui,
+        api_url,
+        backend_pool=backend_pool,
+        webhook_receiver=webhook_receiver,
+        idle_scaler=idle_scaler,
+    )
+    launch_gradio_app(app, routes=routes, share=True)
 
 
 if __name__ == "__main__":
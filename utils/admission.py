@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import deque
+
+DEFAULT_MAX_QUEUE_SIZE = 64
+
+
+class QueueFull(Exception):
+    pass
+
+
+class AdmissionQueue:
+    # Lets at most max_concurrency predictions reach the backend at once (cog
+    # runs one at a time and answers 409 to the others), the rest wait in FIFO
+    # order and new ones are refused past max_queue_size waiting.
+    # Only used from the Gradio event loop, so it needs no locking
+    def __init__(self, max_concurrency, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self._running = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def queue_depth(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        started = time.monotonic()
+        if self._running < self.max_concurrency and not self._waiters:
+            self._running += 1
+        else:
+            if self.max_queue_size and len(self._waiters) >= self.max_queue_size:
+                self.shed += 1
+                raise QueueFull(f"{len(self._waiters)} predictions already queued")
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over right as the request went away
+                    self.release()
+                elif future in self._waiters:
+                    self._waiters.remove(future)
+                raise
+        wait = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter so nobody can jump the queue
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "average_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
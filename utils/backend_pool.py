@@ -0,0 +1,44 @@
+import threading
+
+
+class BackendBusy(Exception):
+    # A cog replica answered 409: it is already running a prediction
+    pass
+
+
+class BackendPool:
+    # Spreads predictions over several cog replicas. Cog runs one prediction at
+    # a time, so the replica with the fewest in-flight predictions is picked,
+    # ties going to the one that served the fewest so far
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self._lock = threading.Lock()
+        self._in_flight = {url: 0 for url in self.urls}
+        self._served = {url: 0 for url in self.urls}
+        self.retries = 0
+
+    def acquire(self, exclude=()):
+        with self._lock:
+            candidates = [url for url in self.urls if url not in exclude]
+            if not candidates:
+                return None
+            if exclude:
+                self.retries += 1
+            url = min(
+                candidates, key=lambda url: (self._in_flight[url], self._served[url])
+            )
+            self._in_flight[url] += 1
+            self._served[url] += 1
+            return url
+
+    def release(self, url):
+        with self._lock:
+            self._in_flight[url] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": dict(self._in_flight),
+                "served": dict(self._served),
+                "retries": self.retries,
+            }
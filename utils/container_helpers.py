@@ -0,0 +1,372 @@
+import json
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+import requests
+from utils.http_helpers import DEFAULT_REQUEST_TIMEOUT
+from utils.prediction_helpers import poll_intervals
+
+# Same overall budget as the former 250 polls of 5 seconds
+DEFAULT_READY_TIMEOUT = 1250
+DEFAULT_READY_INITIAL_INTERVAL = 0.1
+DEFAULT_READY_MAX_INTERVAL = 1.0
+# Containers started by grog are labeled, so later runs can find and reuse them
+IMAGE_LABEL = "grog.image"
+PORT_LABEL = "grog.port"
+
+
+def check_nvidia_gpu():
+    try:
+        subprocess.run(
+            ["nvidia-smi"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+        )
+        return True
+    except subprocess.CalledProcessError:
+        return False
+    except FileNotFoundError:
+        return False
+
+
+def count_nvidia_gpus():
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "-L"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            text=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 0
+    return len([line for line in result.stdout.splitlines() if line.startswith("GPU")])
+
+
+def image_exists(docker_image):
+    result = subprocess.run(
+        ["docker", "image", "inspect", docker_image],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def pull_image(docker_image):
+    # Replicate images are pinned by digest, a local copy never needs updating
+    if image_exists(docker_image):
+        return
+    started = time.monotonic()
+    process = subprocess.Popen(
+        ["docker", "pull", docker_image],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    for line in process.stdout:
+        print(f"[pull] {line}", end="")
+    if process.wait() != 0:
+        raise Exception(f"Could not pull {docker_image}")
+    print(f"Pulled {docker_image} in {time.monotonic() - started:.1f}s")
+
+
+def pull_image_in_background(docker_image):
+    # The multi-GB download overlaps with building the Gradio app
+    executor = ThreadPoolExecutor(max_workers=1)
+    pull = executor.submit(pull_image, docker_image)
+    executor.shutdown(wait=False)
+    return pull
+
+
+def find_grog_containers(local_port):
+    # (id, image, state) of the containers grog started on local_port
+    result = subprocess.run(
+        [
+            "docker",
+            "ps",
+            "--all",
+            "--filter",
+            f"label={PORT_LABEL}={local_port}",
+            "--format",
+            f'{{{{.ID}}}}\t{{{{.Label "{IMAGE_LABEL}"}}}}\t{{{{.State}}}}',
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    containers = []
+    for line in result.stdout.splitlines():
+        container_id, image, state = line.split("\t")
+        containers.append((container_id, image, state))
+    return containers
+
+
+def remove_containers(container_ids):
+    if container_ids:
+        subprocess.run(
+            ["docker", "rm", "--force", *container_ids],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def stop_containers(container_ids):
+    if container_ids:
+        print(f"Stopping {len(container_ids)} cog containers...")
+        subprocess.run(
+            ["docker", "stop", *container_ids],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def change_containers_state(command, container_ids):
+    # docker start, stop, pause or unpause
+    result = subprocess.run(
+        ["docker", command, *container_ids],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise Exception(f"docker {command} failed: {result.stderr.strip()}")
+
+
+def reuse_or_remove_containers(docker_image, local_port):
+    # A running container of the same image is reused and the ones grog left
+    # stopped on the port are removed. One still running another image is never
+    # removed, it may be serving another grog app
+    reusable = None
+    stale = []
+    for container_id, image, state in find_grog_containers(local_port):
+        if state in ("exited", "created", "dead"):
+            stale.append(container_id)
+        elif image != docker_image:
+            raise Exception(
+                f"Port {local_port} is used by the running container {container_id[:12]} of {image}, "
+                "stop it or choose another --docker_port"
+            )
+        elif reusable is None:
+            if state == "paused":
+                # Left paused by --idle_action pause
+                change_containers_state("unpause", [container_id])
+            reusable = container_id
+    remove_containers(stale)
+    return reusable
+
+
+def run_docker_container(docker_image, hostname, local_port, gpu=None):
+    # With host networking cog has to be told which port to listen on
+    docker_command = [
+        "docker",
+        "run",
+        "-d",
+        "-h",
+        hostname,
+        "--net",
+        "host",
+        "-p",
+        f"{local_port}:5000",
+        "-e",
+        f"PORT={local_port}",
+        "--label",
+        f"{IMAGE_LABEL}={docker_image}",
+        "--label",
+        f"{PORT_LABEL}={local_port}",
+    ]
+    if gpu is not None:
+        docker_command.append(f"--gpus=device={gpu}")
+    elif check_nvidia_gpu():
+        docker_command.append("--gpus=all")
+
+    docker_command.append(docker_image)
+    # docker run -d prints the container id once the image is pulled and started
+    result = subprocess.run(docker_command, stdout=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Could not start the {docker_image} container")
+    return result.stdout.strip()
+
+
+def container_state(container_id):
+    result = subprocess.run(
+        ["docker", "inspect", "--format", "{{json .State}}", container_id],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout)
+
+
+def stream_container_logs(container_id, prefix, tail="all"):
+    # Model setup (weights download, loading) can take minutes, show its progress
+    process = subprocess.Popen(
+        ["docker", "logs", "--follow", "--tail", tail, container_id],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+    def print_logs():
+        for line in process.stdout:
+            print(f"[{prefix}] {line}", end="")
+
+    threading.Thread(target=print_logs, daemon=True).start()
+    return process
+
+
+def watch_container_exit(container_id):
+    # Set as soon as docker reports the container died, so a crash during setup
+    # fails the start right away instead of after the readiness timeout
+    exited = threading.Event()
+    process = subprocess.Popen(
+        [
+            "docker",
+            "events",
+            "--filter",
+            f"container={container_id}",
+            "--filter",
+            "event=die",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+
+    def wait_for_die():
+        if process.stdout.readline():
+            exited.set()
+
+    threading.Thread(target=wait_for_die, daemon=True).start()
+    return exited, process
+
+
+def fetch_cog_status(hostname, port):
+    # None while cog can't answer yet: not listening, too busy loading the model
+    # (e.g. holding the GIL) to answer in time, or failing with a server error
+    try:
+        response = requests.get(f"http://{hostname}:{port}/health-check", timeout=2)
+        if response.status_code >= 500:
+            return None
+        response.raise_for_status()
+        return response.json()["status"]
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        return None
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Error fetching data: {e}")
+
+
+def wait_for_cog_ready(
+    container_id,
+    hostname,
+    port,
+    timeout=DEFAULT_READY_TIMEOUT,
+    initial_interval=DEFAULT_READY_INITIAL_INTERVAL,
+    max_interval=DEFAULT_READY_MAX_INTERVAL,
+    abort=None,
+    log_tail="all",
+):
+    # cog answers {"status": "STARTING"} while setup() runs and "READY" after,
+    # or "SETUP_FAILED"
+    started = time.monotonic()
+    exited, events_process = watch_container_exit(container_id)
+    logs_process = stream_container_logs(container_id, f"cog:{port}", log_tail)
+    listening_at = None
+    intervals = poll_intervals(initial_interval, max_interval)
+    try:
+        # The container may have died before docker events was listening
+        state = container_state(container_id)
+        if state is not None and not state["Running"]:
+            exited.set()
+        while not exited.is_set():
+            status = fetch_cog_status(hostname, port)
+            if status is not None and listening_at is None:
+                listening_at = time.monotonic()
+            if status == "READY":
+                now = time.monotonic()
+                print(
+                    f"Cog server on port {port} is ready in {now - started:.1f}s "
+                    f"(listening after {listening_at - started:.1f}s)"
+                )
+                return now - started
+            if status == "SETUP_FAILED":
+                raise Exception(f"Cog setup failed on port {port}, see the logs above")
+            if time.monotonic() - started > timeout:
+                raise Exception("Docker image timeout")
+            if abort is not None and abort.is_set():
+                raise Exception(f"Stopped waiting for cog on port {port}")
+            exited.wait(next(intervals))
+        state = container_state(container_id) or {}
+        raise Exception(
+            f"Container {container_id[:12]} exited with code {state.get('ExitCode')} "
+            f"before cog was ready, see the logs above"
+        )
+    finally:
+        events_process.terminate()
+        logs_process.terminate()
+
+
+def warmup_cog(api_url, example_inputs, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+    # The first prediction pays for CUDA initialization and JIT compilation,
+    # run it before users arrive. A failure only means a colder first request
+    started = time.monotonic()
+    try:
+        response = requests.post(
+            api_url, json={"input": example_inputs}, timeout=request_timeout
+        )
+        response.raise_for_status()
+        print(f"Warmup prediction on {api_url} took {time.monotonic() - started:.1f}s")
+    except requests.exceptions.RequestException as e:
+        print(f"Warmup prediction on {api_url} failed: {e}")
+
+
+def start_cog_replica(
+    docker_image, hostname, port, gpu=None, warmup_inputs=None, abort=None
+):
+    container_id = reuse_or_remove_containers(docker_image, port)
+    reused = container_id is not None
+    if reused:
+        print(f"Reusing running container {container_id[:12]} on port {port}")
+        already_ready = fetch_cog_status(hostname, port) == "READY"
+    else:
+        container_id = run_docker_container(docker_image, hostname, str(port), gpu=gpu)
+        already_ready = False
+    wait_for_cog_ready(
+        container_id, hostname, port, abort=abort, log_tail="0" if reused else "all"
+    )
+    if warmup_inputs and not already_ready:
+        warmup_cog(f"http://{hostname}:{port}/predictions", warmup_inputs)
+    return container_id
+
+
+def run_docker_replicas(
+    docker_image, hostname, docker_port, replicas, pull=None, warmup_inputs=None
+):
+    # Replica i listens on docker_port + i and, when there are GPUs, is pinned
+    # to GPU i (wrapping around when there are more replicas than GPUs).
+    # Returns the prediction URLs and the container ids
+    if pull is not None:
+        pull.result()
+    gpu_count = count_nvidia_gpus() if replicas > 1 else 0
+    ports = [docker_port + i for i in range(replicas)]
+    # Replicas set up in parallel, the first one failing fails the start
+    abort = threading.Event()
+    with ThreadPoolExecutor(max_workers=replicas) as executor:
+        futures = [
+            executor.submit(
+                start_cog_replica,
+                docker_image,
+                hostname,
+                port,
+                gpu=i % gpu_count if gpu_count else None,
+                warmup_inputs=warmup_inputs,
+                abort=abort,
+            )
+            for i, port in enumerate(ports)
+        ]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        abort.set()
+        for future in done:
+            future.result()
+    container_ids = [future.result() for future in futures]
+    return [f"http://{hostname}:{port}/predictions" for port in ports], container_ids
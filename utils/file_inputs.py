@@ -0,0 +1,59 @@
+import asyncio
+import base64
+import mimetypes
+import os
+from utils.http_helpers import backend_key
+
+# Replicate recommends data URIs only for small files, cog on the same machine
+# can take much larger ones before the base64 JSON body gets heavier than a
+# second download through Gradio
+DEFAULT_INLINE_FILE_MAX_SIZE = 1024**2
+DEFAULT_LOCAL_INLINE_FILE_MAX_SIZE = 25 * 1024**2
+
+
+def file_mime_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def file_to_data_uri(path):
+    with open(path, "rb") as file:
+        encoded = base64.b64encode(file.read()).decode()
+    return f"data:{file_mime_type(path)};base64,{encoded}"
+
+
+def files_api_url(api_url):
+    return f"{backend_key(api_url)}/v1/files"
+
+
+async def upload_file(client, files_url, path, headers):
+    # https://replicate.com/docs/reference/http#files.create, the returned URL
+    # can be used as a prediction input without the Gradio app being public
+    upload_headers = {
+        name: value for name, value in headers.items() if name != "Content-Type"
+    }
+    with open(path, "rb") as file:
+        response = await client.post(
+            files_url,
+            headers=upload_headers,
+            files={"content": (os.path.basename(path), file, file_mime_type(path))},
+        )
+    response.raise_for_status()
+    return response.json()["urls"]["get"]
+
+
+async def file_input_value(
+    path,
+    base_url,
+    inline_max_size=DEFAULT_INLINE_FILE_MAX_SIZE,
+    client=None,
+    files_url=None,
+    headers={},
+):
+    # Small files travel inline in the prediction request, larger ones are
+    # uploaded to Replicate or downloaded by cog from Gradio's /file= route
+    if os.path.getsize(path) <= inline_max_size:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, file_to_data_uri, path)
+    if files_url:
+        return await upload_file(client, files_url, path, headers)
+    return f"{base_url}/file=" + path
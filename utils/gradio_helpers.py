@@ -1,255 +1,100 @@
-import gradio as gr
+import asyncio
 from urllib.parse import urlparse
-import requests
+import os
+import threading
 import time
-from PIL import Image
-import base64
-import io
 import uuid
-import os
+from utils.admission import QueueFull
+from utils.backend_pool import BackendBusy
+from utils.file_inputs import DEFAULT_INLINE_FILE_MAX_SIZE, file_input_value
+from utils.metrics import (
+    PredictionTrace,
+    collect_app_stats,
+    default_metrics,
+    traced,
+)
+from utils.preprocessing import preprocess_input
+from utils.http_helpers import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_REQUEST_TIMEOUT,
+    get_async_client,
+)
+from utils.output_store import (
+    DEFAULT_OUTPUT_CACHE_SIZE,
+    DEFAULT_OUTPUT_DIR,
+    DEFAULT_OUTPUT_MAX_AGE,
+    OutputStore,
+)
+from utils.result_cache import payload_key
+from utils.single_flight import SingleFlight
+from utils.ui_spec import build_ui_spec, render_components, render_source
+from utils.prediction_helpers import (
+    DEFAULT_BUSY_RETRY_TIMEOUT,
+    DEFAULT_MAX_POLL_INTERVAL,
+    DEFAULT_PREDICTION_TIMEOUT,
+    TERMINAL_STATUSES,
+    WEBHOOK_PATH,
+    poll_intervals,
+    watch_completion,
+)
 
+default_output_store = None
+default_output_store_lock = threading.Lock()
 
-def extract_property_info(prop):
-    combined_prop = {}
-    merge_keywords = ["allOf", "anyOf", "oneOf"]
-
-    for keyword in merge_keywords:
-        if keyword in prop:
-            for subprop in prop[keyword]:
-                combined_prop.update(subprop)
-            del prop[keyword]
-
-    if not combined_prop:
-        combined_prop = prop.copy()
-
-    for key in ["description", "default"]:
-        if key in prop:
-            combined_prop[key] = prop[key]
-
-    return combined_prop
-
-
-def detect_file_type(filename):
-    audio_extensions = [".mp3", ".wav", ".flac", ".aac", ".ogg", ".m4a"]
-    image_extensions = [
-        ".jpg",
-        ".jpeg",
-        ".png",
-        ".gif",
-        ".bmp",
-        ".tiff",
-        ".svg",
-        ".webp",
-    ]
-    video_extensions = [
-        ".mp4",
-        ".mov",
-        ".wmv",
-        ".flv",
-        ".avi",
-        ".avchd",
-        ".mkv",
-        ".webm",
-    ]
-
-    # Extract the file extension
-    if isinstance(filename, str):
-        extension = filename[filename.rfind(".") :].lower()
-
-        # Check the extension against each list
-        if extension in audio_extensions:
-            return "audio"
-        elif extension in image_extensions:
-            return "image"
-        elif extension in video_extensions:
-            return "video"
-        else:
-            return "string"
-    elif isinstance(filename, list):
-        return "list"
-
-
-def build_gradio_inputs(ordered_input_schema, example_inputs=None):
-    inputs = []
-    input_field_strings = """inputs = []\n"""
-    names = []
-    for index, (name, prop) in enumerate(ordered_input_schema):
-        names.append(name)
-        prop = extract_property_info(prop)
-        if "enum" in prop:
-            input_field = gr.Dropdown(
-                choices=prop["enum"],
-                label=prop.get("title"),
-                info=prop.get("description"),
-                value=prop.get("default"),
-            )
-            input_field_string = f"""inputs.append(gr.Dropdown(
-    choices={prop["enum"]}, label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value="{prop.get("default")}"
-))\n"""
-        elif prop["type"] == "integer":
-            if prop.get("minimum") and prop.get("maximum"):
-                input_field = gr.Slider(
-                    label=prop.get("title"),
-                    info=prop.get("description"),
-                    value=prop.get("default"),
-                    minimum=prop.get("minimum"),
-                    maximum=prop.get("maximum"),
-                    step=1,
-                )
-                input_field_string = f"""inputs.append(gr.Slider(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value={prop.get("default")},
-    minimum={prop.get("minimum")}, maximum={prop.get("maximum")}, step=1,
-))\n"""
-            else:
-                input_field = gr.Number(
-                    label=prop.get("title"),
-                    info=prop.get("description"),
-                    value=prop.get("default"),
-                )
-                input_field_string = f"""inputs.append(gr.Number(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value={prop.get("default")}
-))\n"""
-        elif prop["type"] == "number":
-            if prop.get("minimum") and prop.get("maximum"):
-                input_field = gr.Slider(
-                    label=prop.get("title"),
-                    info=prop.get("description"),
-                    value=prop.get("default"),
-                    minimum=prop.get("minimum"),
-                    maximum=prop.get("maximum"),
-                )
-                input_field_string = f"""inputs.append(gr.Slider(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value={prop.get("default")},
-    minimum={prop.get("minimum")}, maximum={prop.get("maximum")}
-))\n"""
-            else:
-                input_field = gr.Number(
-                    label=prop.get("title"),
-                    info=prop.get("description"),
-                    value=prop.get("default"),
-                )
-                input_field_string = f"""inputs.append(gr.Number(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value={prop.get("default")}
-))\n"""
-        elif prop["type"] == "boolean":
-            input_field = gr.Checkbox(
-                label=prop.get("title"),
-                info=prop.get("description"),
-                value=prop.get("default"),
-            )
-            input_field_string = f"""inputs.append(gr.Checkbox(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}, value={prop.get("default")}
-))\n"""
-        elif (
-            prop["type"] == "string" and prop.get("format") == "uri" and example_inputs
-        ):
-            input_type_example = example_inputs.get(name, None)
-            if input_type_example:
-                input_type = detect_file_type(input_type_example)
-            else:
-                input_type = None
-            if input_type == "image":
-                input_field = gr.Image(label=prop.get("title"), type="filepath")
-                input_field_string = f"""inputs.append(gr.Image(
-    label="{prop.get("title")}", type="filepath"
-))\n"""
-            elif input_type == "audio":
-                input_field = gr.Audio(label=prop.get("title"), type="filepath")
-                input_field_string = f"""inputs.append(gr.Audio(
-    label="{prop.get("title")}", type="filepath"
-))\n"""
-            elif input_type == "video":
-                input_field = gr.Video(label=prop.get("title"))
-                input_field_string = f"""inputs.append(gr.Video(
-    label="{prop.get("title")}"
-))\n"""
-            else:
-                input_field = gr.File(label=prop.get("title"))
-                input_field_string = f"""inputs.append(gr.File(
-    label="{prop.get("title")}"
-))\n"""
-        else:
-            input_field = gr.Textbox(
-                label=prop.get("title"),
-                info=prop.get("description"),
-            )
-            input_field_string = f"""inputs.append(gr.Textbox(
-    label="{prop.get("title")}", info={"'''"+prop.get("description")+"'''" if prop.get("description") else 'None'}
-))\n"""
-        inputs.append(input_field)
-        input_field_strings += f"{input_field_string}\n"
-
-    input_field_strings += f"names = {names}\n"
-
-    return inputs, input_field_strings, names
-
-
-def build_gradio_outputs_replicate(output_types):
-    outputs = []
-    output_field_strings = """outputs = []\n"""
-    if output_types:
-        for output in output_types:
-            if output == "image":
-                output_field = gr.Image()
-                output_field_string = "outputs.append(gr.Image())"
-            elif output == "audio":
-                output_field = gr.Audio(type="filepath")
-                output_field_string = "outputs.append(gr.Audio(type='filepath'))"
-            elif output == "video":
-                output_field = gr.Video()
-                output_field_string = "outputs.append(gr.Video())"
-            elif output == "string":
-                output_field = gr.Textbox()
-                output_field_string = "outputs.append(gr.Textbox())"
-            elif output == "json":
-                output_field = gr.JSON()
-                output_field_string = "outputs.append(gr.JSON())"
-            elif output == "list":
-                output_field = gr.JSON()
-                output_field_string = "outputs.append(gr.JSON())"
-            outputs.append(output_field)
-            output_field_strings += f"{output_field_string}\n"
-    else:
-        output_field = gr.JSON()
-        output_field_string = "outputs.append(gr.JSON())"
-        outputs.append(output_field)
 
-    return outputs, output_field_strings
+def build_gradio_inputs(
+    ordered_input_schema, example_inputs=None, build_components=True
+):
+    # Static apps only need the source of the components, which skips importing gradio
+    spec = build_ui_spec(ordered_input_schema, example_inputs)
+    inputs = render_components(spec["inputs"]) if build_components else []
+    input_field_strings = render_source(spec["inputs"], "inputs")
+    input_field_strings += f"names = {spec['names']}\n"
+    return inputs, input_field_strings, spec["names"]
+
+
+def build_gradio_outputs_replicate(output_types, build_components=True):
+    spec = build_ui_spec([], output_types=output_types)
+    outputs = render_components(spec["outputs"]) if build_components else []
+    return outputs, render_source(spec["outputs"], "outputs")
 
 
 def build_gradio_outputs_cog():
     pass
 
 
-def process_outputs(outputs):
+def get_default_output_store():
+    global default_output_store
+    with default_output_store_lock:
+        if default_output_store is None:
+            default_output_store = OutputStore()
+    return default_output_store
+
+
+# Extensions of the files data URI outputs are decoded to
+DATA_URI_EXTENSIONS = {"data:image": ".png", "data:audio": ".wav", "data:video": ".mp4"}
+
+
+def data_uri_default_extension(value):
+    for prefix, extension in DATA_URI_EXTENSIONS.items():
+        if value.startswith(prefix):
+            return extension
+    return None
+
+
+def process_outputs(outputs, output_store=None):
+    output_store = output_store or get_default_output_store()
     output_values = []
     for output in outputs:
         if not output:
             continue
         if isinstance(output, str):
-            if output.startswith("data:image"):
-                base64_data = output.split(",", 1)[1]
-                image_data = base64.b64decode(base64_data)
-                image_stream = io.BytesIO(image_data)
-                image = Image.open(image_stream)
-                output_values.append(image)
-            elif output.startswith("data:audio"):
-                base64_data = output.split(",", 1)[1]
-                audio_data = base64.b64decode(base64_data)
-                audio_stream = io.BytesIO(audio_data)
-                filename = f"{uuid.uuid4()}.wav"  # Change format as needed
-                with open(filename, "wb") as audio_file:
-                    audio_file.write(audio_stream.getbuffer())
-                output_values.append(filename)
-            elif output.startswith("data:video"):
-                base64_data = output.split(",", 1)[1]
-                video_data = base64.b64decode(base64_data)
-                video_stream = io.BytesIO(video_data)
-                # Here you can save the audio or return the stream for further processing
-                filename = f"{uuid.uuid4()}.mp4"  # Change format as needed
-                with open(filename, "wb") as video_file:
-                    video_file.write(video_stream.getbuffer())
-                output_values.append(filename)
+            # Gradio reads images from disk lazily, no need to decode them here
+            extension = data_uri_default_extension(output)
+            if extension is not None:
+                output_values.append(output_store.save_data_uri(output, extension))
             else:
                 output_values.append(output)
         else:
@@ -257,6 +102,35 @@ def process_outputs(outputs):
     return output_values
 
 
+def store_output_files(output, output_store=None):
+    # The same output with its data URIs replaced by the files they decode to
+    output_store = output_store or get_default_output_store()
+    if isinstance(output, dict):
+        return {
+            key: store_output_files(value, output_store)
+            for key, value in output.items()
+        }
+    if isinstance(output, list):
+        return [store_output_files(value, output_store) for value in output]
+    if isinstance(output, str):
+        extension = data_uri_default_extension(output)
+        if extension is not None:
+            return output_store.save_data_uri(output, extension)
+    return output
+
+
+def output_files_exist(output, output_store=None):
+    # The output store evicts files, outputs pointing to them can go stale
+    output_store = output_store or get_default_output_store()
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, list):
+        return all(output_files_exist(value, output_store) for value in output)
+    if isinstance(output, str) and output.startswith(output_store.directory + os.sep):
+        return os.path.exists(output)
+    return True
+
+
 def parse_outputs(data):
     if isinstance(data, dict):
         # Handle case where data is an object
@@ -281,6 +155,50 @@ def parse_outputs(data):
         return [data]
 
 
+def prepare_outputs(
+    output, outputs, concatenate_outputs=False, output_store=None, final=True
+):
+    # Iterator models (e.g. LLMs) return a list of chunks meant to be joined
+    if concatenate_outputs and isinstance(output, list):
+        output = "".join(str(chunk) for chunk in output)
+    # If the output component is JSON return the entire output response
+    if outputs[0].get_config()["name"] == "json":
+        return output
+    predict_outputs = parse_outputs(output)
+    processed_outputs = process_outputs(predict_outputs, output_store)
+    difference_outputs = len(outputs) - len(processed_outputs)
+    if final and len(outputs) > 1:
+        import gradio as gr
+
+        # Show again the outputs a previous result hid
+        processed_outputs = [
+            gr.update(value=value, visible=True) for value in processed_outputs
+        ]
+    # If less outputs than expected, hide the extra ones. Partial outputs of
+    # iterator models leave them as they are until the final one
+    if difference_outputs > 0:
+        import gradio as gr
+
+        extra_output = gr.update(visible=False) if final else gr.update()
+        processed_outputs.extend([extra_output] * difference_outputs)
+    # If more outputs than expected, cap the outputs to the expected number
+    elif difference_outputs < 0:
+        processed_outputs = processed_outputs[:difference_outputs]
+
+    return (
+        tuple(processed_outputs) if len(processed_outputs) > 1 else processed_outputs[0]
+    )
+
+
+def local_server_port(request, app):
+    # The port the Gradio server listens on, also behind a share link and when
+    # the app is one tab of a gateway (only the gateway is launched)
+    server = getattr(getattr(request, "request", None), "scope", {}).get("server")
+    if server:
+        return server[1]
+    return getattr(app, "server_port", None) or 7860
+
+
 def create_dynamic_gradio_app(
     inputs,
     outputs,
@@ -292,67 +210,306 @@ def create_dynamic_gradio_app(
     names=[],
     local_base=False,
     hostname="0.0.0.0",
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    request_timeout=DEFAULT_REQUEST_TIMEOUT,
+    poll_interval_max=DEFAULT_MAX_POLL_INTERVAL,
+    prediction_timeout=DEFAULT_PREDICTION_TIMEOUT,
+    completion_mode="poll",
+    webhook_receiver=None,
+    webhook_url=None,
+    concatenate_outputs=False,
+    output_store=None,
+    result_cache=None,
+    coalesce_requests=False,
+    backend_pool=None,
+    admission_queue=None,
+    inline_file_max_size=DEFAULT_INLINE_FILE_MAX_SIZE,
+    files_url=None,
+    preprocess_config={},
+    model_id=None,
+    metrics=None,
+    json_logs=False,
+    cog_async=False,
+    idle_scaler=None,
 ):
-    expected_outputs = len(outputs)
+    import gradio as gr
+    import httpx
+
+    output_store = output_store or get_default_output_store()
+    single_flight = SingleFlight() if coalesce_requests else None
+    # Local models answer with data URIs, their cached results point to the
+    # decoded files instead (JSON outputs are shown as they came)
+    cache_output_files = (
+        result_cache is not None
+        and api_id is None
+        and outputs[0].get_config()["name"] != "json"
+    )
+    cache_valid = None
+    if cache_output_files:
+        cache_valid = lambda output: output_files_exist(output, output_store)
+    metrics = metrics or default_metrics
+    labels = {"model": model_id or ""}
+    collect_app_stats(
+        metrics, admission_queue, backend_pool, result_cache, idle_scaler, **labels
+    )
+
+    async def submit_cog_prediction(client, url, payload, headers):
+        # cog answers right away and reports the prediction to the webhook
+        # receiver, the id chosen here is what it can be canceled with
+        prediction_id = uuid.uuid4().hex
+        started = time.monotonic()
+        intervals = poll_intervals()
+        while True:
+            response = await client.put(
+                f"{url}/{prediction_id}",
+                headers={**headers, "Prefer": "respond-async"},
+                json={**payload, "id": prediction_id},
+            )
+            # With replicas another one is tried instead
+            if (
+                response.status_code != 409
+                or backend_pool is not None
+                or time.monotonic() - started > DEFAULT_BUSY_RETRY_TIMEOUT
+            ):
+                return response, prediction_id
+            await asyncio.sleep(next(intervals))
+
+    async def run_prediction_on(url, payload, headers, trace):
+        # Yields the intermediate predictions carrying partial output, then the final one
+        client = get_async_client(url, pool_size, max_retries, request_timeout)
+        with trace.stage("submit"):
+            if cog_async:
+                response, prediction_id = await submit_cog_prediction(
+                    client, url, payload, headers
+                )
+            else:
+                # Local cog answers on the same request, so the read has to last
+                # as long as the prediction is allowed to
+                try:
+                    response = await client.post(
+                        url,
+                        headers=headers,
+                        json=payload,
+                        timeout=httpx.Timeout(
+                            prediction_timeout, connect=DEFAULT_CONNECT_TIMEOUT
+                        ),
+                    )
+                except httpx.TimeoutException:
+                    raise gr.Error(
+                        f"The prediction did not finish in {prediction_timeout} seconds."
+                    )
+        if response.status_code in (201, 202):
+            prediction = response.json()
+            if cog_async:
+                prediction["id"] = prediction_id
+                prediction["status"] = prediction.get("status") or "starting"
+                prediction["urls"] = {"cancel": f"{url}/{prediction_id}/cancel"}
+            trace.fields["prediction_id"] = prediction.get("id")
+            started = time.perf_counter()
+            try:
+                async for prediction in watch_completion(
+                    client,
+                    prediction,
+                    headers,
+                    completion_mode=completion_mode,
+                    webhook_receiver=webhook_receiver,
+                    max_interval=poll_interval_max,
+                    timeout=prediction_timeout,
+                    stats=trace.fields,
+                ):
+                    # Consumers stop reading at the final prediction
+                    if prediction["status"] in TERMINAL_STATUSES:
+                        trace.add("completion", time.perf_counter() - started)
+                    yield prediction
+            except TimeoutError:
+                raise gr.Error(
+                    f"The prediction did not finish in {prediction_timeout} seconds."
+                )
+        elif response.status_code == 200:
+            prediction = response.json()
+            prediction.setdefault("status", "succeeded")
+            yield prediction
+        else:
+            if response.status_code == 409:
+                if backend_pool is not None:
+                    raise BackendBusy(url)
+                raise gr.Error(
+                    f"Sorry, the Cog image is still processing. Try again in a bit."
+                )
+            raise gr.Error(f"The submission failed! Error: {response.status_code}")
+
+    async def dispatch_prediction(payload, headers, trace):
+        if backend_pool is None:
+            async for prediction in run_prediction_on(api_url, payload, headers, trace):
+                yield prediction
+            return
+        # Least busy replica first, moving on to the next one when a replica is
+        # busy (409) or unreachable, both happen before any work started
+        tried = set()
+        while True:
+            url = backend_pool.acquire(exclude=tried)
+            if url is None:
+                raise gr.Error(
+                    "Sorry, all the Cog replicas are still processing. Try again in a bit."
+                )
+            started = False
+            try:
+                async for prediction in run_prediction_on(url, payload, headers, trace):
+                    started = True
+                    yield prediction
+                return
+            except (BackendBusy, httpx.ConnectError):
+                if started:
+                    raise
+                tried.add(url)
+            finally:
+                backend_pool.release(url)
+
+    async def queue_prediction(payload, headers, trace):
+        if admission_queue is None:
+            async for prediction in dispatch_prediction(payload, headers, trace):
+                yield prediction
+            return
+        try:
+            wait = await admission_queue.acquire()
+        except QueueFull:
+            raise gr.Error(
+                "Sorry, too many requests are waiting for the model. Try again in a bit."
+            )
+        trace.add("queue", wait)
+        try:
+            async for prediction in dispatch_prediction(payload, headers, trace):
+                yield prediction
+        finally:
+            admission_queue.release()
+
+    async def run_prediction(payload, headers, trace):
+        if idle_scaler is None:
+            async for prediction in queue_prediction(payload, headers, trace):
+                yield prediction
+            return
+        # Stopped containers set the model up again, which can take minutes
+        if not idle_scaler.awake:
+            gr.Info("The model is warming up after being idle, this can take a while.")
+        try:
+            wait = await idle_scaler.acquire()
+        except Exception as e:
+            raise gr.Error(f"The model could not be woken up: {e}")
+        if wait:
+            trace.add("wake", wait)
+        try:
+            async for prediction in queue_prediction(payload, headers, trace):
+                yield prediction
+        finally:
+            idle_scaler.release()
+
+    async def render_outputs(output, trace, final=True):
+        # Decoding and writing large outputs would block the event loop
+        with trace.stage("outputs"):
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                prepare_outputs,
+                output,
+                outputs,
+                concatenate_outputs,
+                output_store,
+                final,
+            )
 
-    def predict(request: gr.Request, *args, progress=gr.Progress(track_tqdm=True)):
+    async def predict_outputs(request, args, trace):
+        # Keyed on the local upload paths rather than their per-host /file= URLs,
+        # a hit skips preprocessing and uploading the files
+        input_values = dict(zip(names, args))
+        cache_key = result_cache.key(input_values) if result_cache else None
+        if cache_key is not None:
+            # Reading entries from disk would block the event loop
+            cached_output = await asyncio.get_running_loop().run_in_executor(
+                None, result_cache.get, cache_key, cache_valid
+            )
+            if cached_output is not None:
+                trace.status = "cached"
+                yield await render_outputs(cached_output, trace)
+                return
         payload = {"input": {}}
         if api_id:
             payload["version"] = api_id
-        parsed_url = urlparse(str(request.url))
+        headers = {"Content-Type": "application/json"}
+        if replicate_token:
+            headers["Authorization"] = f"Token {replicate_token}"
         if local_base:
             base_url = f"http://{hostname}:7860"
+        elif api_id is None:
+            # cog shares the host network with the Gradio server, it fetches the
+            # files directly rather than through the share link
+            base_url = f"http://127.0.0.1:{local_server_port(request, app)}"
         else:
+            parsed_url = urlparse(str(request.url))
             base_url = parsed_url.scheme + "://" + parsed_url.netloc
-        for i, key in enumerate(names):
-            value = args[i]
-            if value and (os.path.exists(str(value))):
-                value = f"{base_url}/file=" + value
-            if value is not None and value != "":
-                payload["input"][key] = value
-        print(payload)
-        headers = {"Content-Type": "application/json"}
-        if replicate_token:
-            headers["Authorization"] = f"Token {replicate_token}"
-        print(headers)
-        response = requests.post(api_url, headers=headers, json=payload)
-        if response.status_code == 201:
-            follow_up_url = response.json()["urls"]["get"]
-            response = requests.get(follow_up_url, headers=headers)
-            while response.json()["status"] != "succeeded":
-                if response.json()["status"] == "failed":
-                    raise gr.Error("The submission failed!")
-                response = requests.get(follow_up_url, headers=headers)
-                time.sleep(1)
-                # TODO: Add a failing mechanism if the API gets stuck
-        if response.status_code == 200:
-            json_response = response.json()
-            # If the output component is JSON return the entire output response
-            if outputs[0].get_config()["name"] == "json":
-                return json_response["output"]
-            predict_outputs = parse_outputs(json_response["output"])
-            processed_outputs = process_outputs(predict_outputs)
-            difference_outputs = expected_outputs - len(processed_outputs)
-            # If less outputs than expected, hide the extra ones
-            if difference_outputs > 0:
-                extra_outputs = [gr.update(visible=False)] * difference_outputs
-                processed_outputs.extend(extra_outputs)
-            # If more outputs than expected, cap the outputs to the expected number if
-            elif difference_outputs < 0:
-                processed_outputs = processed_outputs[:difference_outputs]
-
-            return (
-                tuple(processed_outputs)
-                if len(processed_outputs) > 1
-                else processed_outputs[0]
+        with trace.stage("payload"):
+            for i, key in enumerate(names):
+                value = args[i]
+                if value and (os.path.exists(str(value))):
+                    with trace.stage("preprocess"):
+                        value = await preprocess_input(value, key, preprocess_config)
+                    with trace.stage("upload"):
+                        value = await file_input_value(
+                            value,
+                            base_url,
+                            inline_file_max_size,
+                            get_async_client(
+                                api_url, pool_size, max_retries, request_timeout
+                            ),
+                            files_url,
+                            headers,
+                        )
+                if value is not None and value != "":
+                    payload["input"][key] = value
+        if completion_mode == "webhook":
+            webhook_base_url = base_url
+            if cog_async:
+                # cog shares the host network with the Gradio server
+                server_port = local_server_port(request, app)
+                webhook_base_url = f"http://127.0.0.1:{server_port}"
+            payload["webhook"] = webhook_receiver.callback_url(
+                webhook_url or f"{webhook_base_url}{WEBHOOK_PATH}"
+            )
+            payload["webhook_events_filter"] = ["output", "completed"]
+        elif completion_mode == "stream":
+            payload["stream"] = True
+        if single_flight is not None:
+            # Identical concurrent requests share one upstream prediction
+            predictions = single_flight.subscribe(
+                payload_key(input_values, api_id or api_url),
+                lambda: run_prediction(payload, headers, trace),
             )
-
         else:
-            if response.status_code == 409:
-                raise gr.Error(
-                    f"Sorry, the Cog image is still processing. Try again in a bit."
+            predictions = run_prediction(payload, headers, trace)
+        async for json_response in predictions:
+            if json_response["status"] in TERMINAL_STATUSES:
+                break
+            # Surface partial output of iterator models as it arrives
+            yield await render_outputs(json_response["output"], trace, final=False)
+        trace.record_prediction(json_response)
+        if json_response["status"] != "succeeded":
+            raise gr.Error(f"The submission failed! {json_response.get('error') or ''}")
+        output = json_response["output"]
+        if cache_key is not None:
+            loop = asyncio.get_running_loop()
+            if cache_output_files:
+                # Cache the decoded files rather than holding the data URIs
+                output = await loop.run_in_executor(
+                    None, store_output_files, output, output_store
                 )
-            raise gr.Error(f"The submission failed! Error: {response.status_code}")
+            await loop.run_in_executor(None, result_cache.set, cache_key, output)
+        yield await render_outputs(output, trace)
+
+    async def predict(
+        request: gr.Request, *args, progress=gr.Progress(track_tqdm=True)
+    ):
+        trace = PredictionTrace(metrics, json_logs, **labels)
+        async for output in traced(trace, predict_outputs(request, args, trace)):
+            yield output
 
     app = gr.Interface(
         fn=predict,
@@ -361,10 +518,50 @@ def create_dynamic_gradio_app(
         title=title,
         description=model_description,
         allow_flagging="never",
+        # Gradio runs one prediction at a time by default, backend concurrency
+        # is bounded by admission_queue instead so cached results never wait
+        concurrency_limit=None,
     )
     return app
 
 
+def create_gateway_app(apps, model_ids):
+    import gradio as gr
+
+    return gr.TabbedInterface(
+        apps,
+        tab_names=model_ids,
+        title=f"Demos for {len(apps)} cog models",
+    )
+
+
+def webhook_route(webhook_receiver):
+    from fastapi import Request, Response
+
+    async def receive_webhook(request: Request):
+        body = await request.body()
+        try:
+            delivered = webhook_receiver.deliver(
+                body, request.headers, request.query_params.get("token")
+            )
+        except ValueError:
+            return Response(status_code=400)
+        if not delivered:
+            return Response(status_code=401)
+        return Response(status_code=200)
+
+    return WEBHOOK_PATH, receive_webhook, ["POST"]
+
+
+def launch_gradio_app(app, routes=[], **launch_kwargs):
+    # Gradio only creates its FastAPI server on launch, so extra routes
+    # (e.g. the webhook receiver) are registered right after it starts
+    app.launch(prevent_thread_lock=True, **launch_kwargs)
+    for path, endpoint, methods in routes:
+        app.server_app.add_api_route(path, endpoint, methods=methods)
+    app.block_thread()
+
+
 def create_gradio_app_script(
     inputs_string,
     outputs_string,
@@ -374,7 +571,23 @@ def create_gradio_app_script(
     title="",
     model_description="",
     local_base=False,
-    hostname="0.0.0.0"
+    hostname="0.0.0.0",
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    request_timeout=DEFAULT_REQUEST_TIMEOUT,
+    poll_interval_max=DEFAULT_MAX_POLL_INTERVAL,
+    prediction_timeout=DEFAULT_PREDICTION_TIMEOUT,
+    completion_mode="poll",
+    webhook_url=None,
+    concatenate_outputs=False,
+    output_dir=DEFAULT_OUTPUT_DIR,
+    output_cache_size=DEFAULT_OUTPUT_CACHE_SIZE,
+    output_max_age=DEFAULT_OUTPUT_MAX_AGE,
+    inline_file_max_size=DEFAULT_INLINE_FILE_MAX_SIZE,
+    files_url=None,
+    preprocess_config={},
+    model_id=None,
+    json_logs=False,
 ):
     headers = {"Content-Type": "application/json"}
     if replicate_token:
@@ -382,58 +595,113 @@ def create_gradio_app_script(
 
     if local_base:
         base_url = f'base_url = "http://{hostname}:7860"'
+        base_url_import = ""
+    elif api_id is None:
+        # cog runs next to the Gradio server and fetches the files directly
+        base_url = 'base_url = f"http://127.0.0.1:{local_server_port(request, app)}"'
+        base_url_import = "from utils.gradio_helpers import local_server_port\n"
     else:
         base_url = """parsed_url = urlparse(str(request.url))
     base_url = parsed_url.scheme + "://" + parsed_url.netloc"""
+        base_url_import = "from urllib.parse import urlparse\n"
     headers_string = f"""headers = {headers}\n"""
+    client_string = f"""pool_size = {pool_size}
+max_retries = {max_retries}
+request_timeout = {request_timeout}
+poll_interval_max = {poll_interval_max}
+prediction_timeout = {prediction_timeout}
+completion_mode = "{completion_mode}"
+concatenate_outputs = {concatenate_outputs}
+output_store = OutputStore("{output_dir}", max_size={output_cache_size}, max_age={output_max_age})
+inline_file_max_size = {inline_file_max_size}
+files_url = {f'"{files_url}"' if files_url else None}
+preprocess_config = {preprocess_config}
+model_id = "{model_id or ''}"
+json_logs = {json_logs}\n"""
+    if completion_mode == "webhook":
+        client_string += f"""webhook_secret = fetch_webhook_secret(get_session("{api_url}"), "{api_url}", {headers})
+webhook_receiver = None
+if webhook_secret is None:
+    # Unverified webhooks would let anyone forge predictions
+    print("Falling back to polling for finished predictions")
+    completion_mode = "poll"
+else:
+    webhook_receiver = WebhookReceiver(secret=webhook_secret)\n"""
+        webhook_url_value = (
+            f'"{webhook_url}"' if webhook_url else 'f"{base_url}{WEBHOOK_PATH}"'
+        )
+        completion_string = f"""if webhook_receiver is not None:
+        payload["webhook"] = {webhook_url_value}
+        payload["webhook_events_filter"] = ["output", "completed"]\n"""
+        launch_string = """routes = [metrics_route()]
+if webhook_receiver is not None:
+    routes.append(webhook_route(webhook_receiver))
+launch_gradio_app(app, routes=routes, share=True)"""
+    else:
+        client_string += "webhook_receiver = None\n"
+        completion_string = (
+            'payload["stream"] = True\n' if completion_mode == "stream" else ""
+        )
+        launch_string = "launch_gradio_app(app, routes=[metrics_route()], share=True)"
     api_id_value = f'payload["version"] = "{api_id}"' if api_id is not None else ""
-    definition_string = """expected_outputs = len(outputs)
-def predict(request: gr.Request, *args, progress=gr.Progress(track_tqdm=True)):"""
+    definition_string = """async def predict_outputs(request, args, trace):"""
     payload_string = f"""payload = {{"input": {{}}}}
     {api_id_value}
     
     {base_url}
-    for i, key in enumerate(names):
-        value = args[i]
-        if value and (os.path.exists(str(value))):
-            value = f"{{base_url}}/file=" + value
-        if value is not None and value != "":
-            payload["input"][key] = value\n"""
-
-    request_string = (
-        f"""response = requests.post("{api_url}", headers=headers, json=payload)\n"""
-    )
+    client = get_async_client("{api_url}", pool_size, max_retries, request_timeout)
+    with trace.stage("payload"):
+        for i, key in enumerate(names):
+            value = args[i]
+            if value and (os.path.exists(str(value))):
+                with trace.stage("preprocess"):
+                    value = await preprocess_input(value, key, preprocess_config)
+                with trace.stage("upload"):
+                    value = await file_input_value(value, base_url, inline_file_max_size, client, files_url, headers)
+            if value is not None and value != "":
+                payload["input"][key] = value
+    {completion_string}"""
+
+    request_string = f"""with trace.stage("submit"):
+        try:
+            response = await client.post("{api_url}", headers=headers, json=payload, timeout=httpx.Timeout(prediction_timeout, connect=DEFAULT_CONNECT_TIMEOUT))
+        except httpx.TimeoutException:
+            raise gr.Error(f"The prediction did not finish in {{prediction_timeout}} seconds.")\n"""
 
     result_string = f"""
     if response.status_code == 201:
-        follow_up_url = response.json()["urls"]["get"]
-        response = requests.get(follow_up_url, headers=headers)
-        while response.json()["status"] != "succeeded":
-            if response.json()["status"] == "failed":
-                raise gr.Error("The submission failed!")
-            response = requests.get(follow_up_url, headers=headers)
-            time.sleep(1)
-    if response.status_code == 200:
+        started = time.perf_counter()
+        try:
+            async for json_response in watch_completion(client, response.json(), headers, completion_mode=completion_mode, webhook_receiver=webhook_receiver, max_interval=poll_interval_max, timeout=prediction_timeout, stats=trace.fields):
+                if json_response["status"] in TERMINAL_STATUSES:
+                    trace.add("completion", time.perf_counter() - started)
+                    break
+                # Surface partial output of iterator models as it arrives
+                yield await render_outputs(json_response["output"], trace, final=False)
+        except TimeoutError:
+            raise gr.Error(f"The prediction did not finish in {{prediction_timeout}} seconds.")
+    elif response.status_code == 200:
         json_response = response.json()
-        #If the output component is JSON return the entire output response 
-        if(outputs[0].get_config()["name"] == "json"):
-            return json_response["output"]
-        predict_outputs = parse_outputs(json_response["output"])
-        processed_outputs = process_outputs(predict_outputs)
-        difference_outputs = expected_outputs - len(processed_outputs)
-        # If less outputs than expected, hide the extra ones
-        if difference_outputs > 0:
-            extra_outputs = [gr.update(visible=False)] * difference_outputs
-            processed_outputs.extend(extra_outputs)
-        # If more outputs than expected, cap the outputs to the expected number
-        elif difference_outputs < 0:
-            processed_outputs = processed_outputs[:difference_outputs]
-        
-        return tuple(processed_outputs) if len(processed_outputs) > 1 else processed_outputs[0]
     else:
         if(response.status_code == 409):
             raise gr.Error(f"Sorry, the Cog image is still processing. Try again in a bit.")
-        raise gr.Error(f"The submission failed! Error: {{response.status_code}}")\n"""
+        raise gr.Error(f"The submission failed! Error: {{response.status_code}}")
+    trace.record_prediction(json_response)
+    if json_response.get("status", "succeeded") != "succeeded":
+        raise gr.Error(f"The submission failed! {{json_response.get('error') or ''}}")
+    yield await render_outputs(json_response["output"], trace)
+
+
+async def render_outputs(output, trace, final=True):
+    # Decoding and writing large outputs would block the event loop
+    with trace.stage("outputs"):
+        return await asyncio.get_running_loop().run_in_executor(None, prepare_outputs, output, outputs, concatenate_outputs, output_store, final)
+
+
+async def predict(request: gr.Request, *args, progress=gr.Progress(track_tqdm=True)):
+    trace = PredictionTrace(json_logs=json_logs, model=model_id)
+    async for output in traced(trace, predict_outputs(request, args, trace)):
+        yield output\n"""
 
     interface_string = f"""title = "{title}"
 model_description = "{model_description}"
@@ -445,20 +713,42 @@ app = gr.Interface(
     title=title,
     description=model_description,
     allow_flagging="never",
+    concurrency_limit={None if api_id else 1},
 )
-app.launch(share=True)
+{launch_string}
 """
 
+    # The webhook helpers are only needed, and used, by webhook apps
+    if completion_mode == "webhook":
+        imports_string = """from utils.gradio_helpers import launch_gradio_app, prepare_outputs, webhook_route
+from utils.http_helpers import DEFAULT_CONNECT_TIMEOUT, get_async_client, get_session
+from utils.prediction_helpers import (
+    TERMINAL_STATUSES,
+    WEBHOOK_PATH,
+    WebhookReceiver,
+    fetch_webhook_secret,
+    watch_completion,
+)"""
+    else:
+        imports_string = """from utils.gradio_helpers import launch_gradio_app, prepare_outputs
+from utils.http_helpers import DEFAULT_CONNECT_TIMEOUT, get_async_client
+from utils.prediction_helpers import TERMINAL_STATUSES, watch_completion"""
+
     app_string = f"""import gradio as gr
-from urllib.parse import urlparse
-import requests
-import time
+import asyncio
+import httpx
 import os
+import time
 
-from utils.gradio_helpers import parse_outputs, process_outputs
+{base_url_import}{imports_string}
+from utils.file_inputs import file_input_value
+from utils.metrics import PredictionTrace, metrics_route, traced
+from utils.preprocessing import preprocess_input
+from utils.output_store import OutputStore
 
 {inputs_string}
 {outputs_string}
+{client_string}
 {definition_string}
     {headers_string}
     {payload_string}
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# Local cog answers synchronous predictions on the same request, so the read
+# timeout has to cover a whole inference
+DEFAULT_REQUEST_TIMEOUT = 600
+DEFAULT_CONNECT_TIMEOUT = 10
+
+_sessions = {}
+_async_clients = {}
+_sessions_lock = threading.Lock()
+
+
+def backend_key(url):
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+
+def create_session(
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+):
+    # Connection errors are retried for every method, but read errors and
+    # retryable status codes only for GET, so a prediction is never submitted twice
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(
+    url,
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+):
+    # One keep-alive session per backend (cog server or api.replicate.com),
+    # shared by every Gradio worker thread
+    key = backend_key(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = create_session(pool_size, max_retries, backoff_factor)
+            _sessions[key] = session
+    return session
+
+
+def create_async_client(
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    request_timeout=DEFAULT_REQUEST_TIMEOUT,
+):
+    # The pool only bounds idle keep-alive connections: in-flight predictions are
+    # never queued behind each other waiting for a free connection.
+    # httpx retries failed connections, retryable statuses are handled by the poll loop
+    import httpx
+
+    transport = httpx.AsyncHTTPTransport(
+        retries=max_retries,
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(request_timeout, connect=DEFAULT_CONNECT_TIMEOUT),
+    )
+
+
+def get_async_client(
+    url,
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    request_timeout=DEFAULT_REQUEST_TIMEOUT,
+):
+    # Async clients are bound to the event loop they were created on (Gradio runs
+    # every async handler on its main loop), so they are shared per backend and loop
+    loop = asyncio.get_running_loop()
+    key = (backend_key(url), loop)
+    with _sessions_lock:
+        for stale_key in [k for k in _async_clients if k[1].is_closed()]:
+            del _async_clients[stale_key]
+        client = _async_clients.get(key)
+        if client is None:
+            client = create_async_client(pool_size, max_retries, request_timeout)
+            _async_clients[key] = client
+    return client
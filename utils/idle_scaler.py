@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.container_helpers import change_containers_state, wait_for_cog_ready
+
+IDLE_ACTIONS = ["stop", "pause"]
+DEFAULT_IDLE_ACTION = "stop"
+DEFAULT_IDLE_CHECK_INTERVAL = 10
+
+
+class IdleScaler:
+    # Stops the cog containers of a model after idle_timeout seconds without
+    # predictions, which frees their GPU memory, and starts them again for the
+    # next one. Paused containers wake up instantly but keep their memory.
+    # Sleeping and waking run one after the other on a single worker thread
+    def __init__(
+        self,
+        container_ids,
+        hostname,
+        ports,
+        idle_timeout,
+        action=DEFAULT_IDLE_ACTION,
+        check_interval=DEFAULT_IDLE_CHECK_INTERVAL,
+    ):
+        self.container_ids = list(container_ids)
+        self.hostname = hostname
+        self.ports = list(ports)
+        self.idle_timeout = idle_timeout
+        self.action = action
+        self.check_interval = min(check_interval, idle_timeout)
+        self.awake = True
+        self.sleeps = 0
+        self.wakes = 0
+        self.total_wake_time = 0.0
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_used = time.monotonic()
+        self._waking = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            with self._lock:
+                idle = (
+                    self.awake
+                    and not self._in_flight
+                    and time.monotonic() - self._last_used >= self.idle_timeout
+                )
+                # From here on a new prediction waits for the containers to wake up
+                if idle:
+                    self.awake = False
+            if idle:
+                self._executor.submit(self._sleep)
+
+    def _sleep(self):
+        print(
+            f"No predictions for {self.idle_timeout:.0f}s, running docker "
+            f"{self.action} on {len(self.container_ids)} cog containers"
+        )
+        try:
+            change_containers_state(self.action, self.container_ids)
+            self.sleeps += 1
+        except Exception as e:
+            print(f"Could not put the cog containers to sleep: {e}")
+            with self._lock:
+                if self._waking is None:
+                    self.awake = True
+                    self._last_used = time.monotonic()
+
+    def _wake(self):
+        started = time.monotonic()
+        try:
+            change_containers_state(
+                "unpause" if self.action == "pause" else "start", self.container_ids
+            )
+            # Replicas set up in parallel, the first one failing fails the wake
+            with ThreadPoolExecutor(max_workers=len(self.container_ids)) as executor:
+                list(
+                    executor.map(
+                        lambda container: wait_for_cog_ready(
+                            container[0], self.hostname, container[1], log_tail="0"
+                        ),
+                        zip(self.container_ids, self.ports),
+                    )
+                )
+            elapsed = time.monotonic() - started
+            print(f"Woke up {len(self.container_ids)} cog containers in {elapsed:.1f}s")
+            with self._lock:
+                self.awake = True
+                self._last_used = time.monotonic()
+                self.wakes += 1
+                self.total_wake_time += elapsed
+        finally:
+            with self._lock:
+                self._waking = None
+
+    async def acquire(self):
+        # Holds off sleeping until release, returns the seconds spent waiting
+        # for the containers to wake up
+        with self._lock:
+            self._in_flight += 1
+            self._last_used = time.monotonic()
+            if self.awake:
+                return 0.0
+            if self._waking is None:
+                self._waking = self._executor.submit(self._wake)
+            waking = self._waking
+        started = time.monotonic()
+        try:
+            # Shared by every request waiting, one going away must not cancel it
+            await asyncio.shield(asyncio.wrap_future(waking))
+        except BaseException:
+            self.release()
+            raise
+        return time.monotonic() - started
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.monotonic()
+
+    def stats(self):
+        return {
+            "awake": self.awake,
+            "sleeps": self.sleeps,
+            "wakes": self.wakes,
+            "average_wake": self.total_wake_time / self.wakes if self.wakes else 0.0,
+        }
@@ -0,0 +1,43 @@
+import json
+import os
+import time
+
+DEFAULT_METADATA_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "grog", "models"
+)
+DEFAULT_METADATA_TTL = 24 * 60 * 60
+
+
+def metadata_cache_path(model_id, cache_dir=DEFAULT_METADATA_CACHE_DIR):
+    return os.path.join(cache_dir, model_id.replace("/", "--") + ".json")
+
+
+def read_cached_metadata(model_id, cache_dir=DEFAULT_METADATA_CACHE_DIR):
+    try:
+        with open(metadata_cache_path(model_id, cache_dir), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_cached_metadata(
+    model_id, model_data, etag=None, cache_dir=DEFAULT_METADATA_CACHE_DIR
+):
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {
+        "model_id": model_id,
+        "version": model_data.get("api_id"),
+        "etag": etag,
+        "fetched_at": time.time(),
+        "model_data": model_data,
+    }
+    path = metadata_cache_path(model_id, cache_dir)
+    # Write then rename, so concurrent replicas never read a half written file
+    with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+        json.dump(entry, file)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return entry
+
+
+def is_fresh(entry, ttl=DEFAULT_METADATA_TTL):
+    return time.time() - entry["fetched_at"] < ttl
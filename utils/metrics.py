@@ -0,0 +1,296 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PATH = "/metrics"
+# Upper bounds in seconds, from a fast local cog call to a long video model
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+)
+STAGE_METRIC = "grog_stage_seconds"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    # Counters and histograms in the Prometheus text format. Gauges and the
+    # counters kept by other objects (admission queue, pool, caches) are read
+    # through callbacks when scraped
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(value)
+
+    def collect(self, name, read, type="gauge", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._collectors[key] = (type, read)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(histogram.counts), histogram.count, histogram.sum)
+                for key, histogram in self._histograms.items()
+            }
+            collectors = dict(self._collectors)
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault((name, "counter"), []).append((name, labels, value))
+        for (name, labels), (type, read) in collectors.items():
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Could not read the {name} metric: {e}")
+                continue
+            samples.setdefault((name, type), []).append((name, labels, value))
+        for (name, labels), (counts, count, total) in histograms.items():
+            histogram = samples.setdefault((name, "histogram"), [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = labels + (("le", bound),)
+                histogram.append((f"{name}_bucket", le, cumulative))
+            histogram.append((f"{name}_bucket", labels + (("le", "+Inf"),), count))
+            histogram.append((f"{name}_sum", labels, total))
+            histogram.append((f"{name}_count", labels, count))
+        lines = []
+        for (name, type), metric_samples in sorted(samples.items()):
+            lines.append(f"# TYPE {name} {type}")
+            for sample_name, labels, value in metric_samples:
+                lines.append(f"{sample_name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+default_metrics = Metrics()
+
+
+class PredictionTrace:
+    # Where the time of one prediction went, stage by stage. Recorded into the
+    # metrics and logged in one line once the prediction ends
+    def __init__(self, metrics=None, json_logs=False, **labels):
+        self.metrics = metrics or default_metrics
+        self.json_logs = json_logs
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.fields = {}
+        self.status = None
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def record_prediction(self, prediction):
+        self.fields["prediction_id"] = prediction.get("id")
+        # Time cog spent in predict(), without queueing and file transfers
+        predict_time = (prediction.get("metrics") or {}).get("predict_time")
+        if predict_time is not None:
+            self.add("inference", predict_time)
+
+    def finish(self, status):
+        self.status = status
+        self.add("total", time.perf_counter() - self.started)
+        for name, seconds in self.timings.items():
+            self.metrics.observe(STAGE_METRIC, seconds, stage=name, **self.labels)
+        self.metrics.inc("grog_predictions_total", status=status, **self.labels)
+        if self.fields.get("polls"):
+            self.metrics.inc("grog_polls_total", self.fields["polls"], **self.labels)
+        self.log()
+
+    def log(self):
+        if self.json_logs:
+            record = {
+                "event": "prediction",
+                "time": time.time(),
+                "status": self.status,
+                **self.labels,
+                **self.fields,
+                "timings": {
+                    name: round(seconds, 6) for name, seconds in self.timings.items()
+                },
+            }
+            print(json.dumps(record), flush=True)
+            return
+        stages = ", ".join(
+            f"{name} {seconds:.3f}s"
+            for name, seconds in self.timings.items()
+            if name != "total"
+        )
+        details = ""
+        if self.fields.get("polls"):
+            details += f", {self.fields['polls']} polls"
+        if "first_output_seconds" in self.fields:
+            details += f", first output {self.fields['first_output_seconds']:.3f}s"
+        print(
+            f"Prediction {self.fields.get('prediction_id') or ''} {self.status} "
+            f"in {self.timings['total']:.3f}s ({stages}){details}"
+        )
+
+
+async def traced(trace, outputs):
+    # Passes the outputs of a predict generator through and finishes the
+    # trace with how it ended
+    status = "failed"
+    try:
+        async for output in outputs:
+            yield output
+        status = trace.status or "succeeded"
+    except (asyncio.CancelledError, GeneratorExit):
+        status = "canceled"
+        raise
+    finally:
+        await outputs.aclose()
+        trace.finish(status)
+
+
+def metrics_route(metrics=None):
+    from fastapi.responses import PlainTextResponse
+
+    metrics = metrics or default_metrics
+
+    async def serve_metrics():
+        return PlainTextResponse(
+            metrics.render(), media_type="text/plain; version=0.0.4"
+        )
+
+    return METRICS_PATH, serve_metrics, ["GET"]
+
+
+def collect_app_stats(
+    metrics,
+    admission_queue=None,
+    backend_pool=None,
+    result_cache=None,
+    idle_scaler=None,
+    **labels,
+):
+    if admission_queue is not None:
+        metrics.collect(
+            "grog_queue_running", lambda: admission_queue.stats()["running"], **labels
+        )
+        metrics.collect("grog_queue_waiting", admission_queue.queue_depth, **labels)
+        metrics.collect(
+            "grog_queue_admitted_total",
+            lambda: admission_queue.admitted,
+            type="counter",
+            **labels,
+        )
+        metrics.collect(
+            "grog_queue_shed_total",
+            lambda: admission_queue.shed,
+            type="counter",
+            **labels,
+        )
+    if backend_pool is not None:
+        for url in backend_pool.urls:
+            metrics.collect(
+                "grog_backend_in_flight",
+                lambda url=url: backend_pool.stats()["in_flight"][url],
+                backend=url,
+                **labels,
+            )
+            metrics.collect(
+                "grog_backend_served_total",
+                lambda url=url: backend_pool.stats()["served"][url],
+                type="counter",
+                backend=url,
+                **labels,
+            )
+        metrics.collect(
+            "grog_backend_retries_total",
+            lambda: backend_pool.retries,
+            type="counter",
+            **labels,
+        )
+    if result_cache is not None:
+        metrics.collect(
+            "grog_result_cache_hits_total",
+            lambda: result_cache.hits,
+            type="counter",
+            **labels,
+        )
+        metrics.collect(
+            "grog_result_cache_misses_total",
+            lambda: result_cache.misses,
+            type="counter",
+            **labels,
+        )
+    if idle_scaler is not None:
+        metrics.collect("grog_backend_awake", lambda: int(idle_scaler.awake), **labels)
+        metrics.collect(
+            "grog_backend_wakes_total",
+            lambda: idle_scaler.wakes,
+            type="counter",
+            **labels,
+        )
+        metrics.collect(
+            "grog_backend_sleeps_total",
+            lambda: idle_scaler.sleeps,
+            type="counter",
+            **labels,
+        )
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote_to_bytes
+
+DEFAULT_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "grog_outputs")
+DEFAULT_OUTPUT_CACHE_SIZE = 2 * 1024**3
+DEFAULT_OUTPUT_MAX_AGE = 24 * 60 * 60
+# A multiple of 4, so every chunk of a base64 payload decodes on its own
+DATA_URI_CHUNK_SIZE = 4 * 256 * 1024
+# mimetypes has no or odd answers for some common model outputs
+EXTENSION_OVERRIDES = {"audio/wav": ".wav", "audio/ogg": ".ogg", "audio/mp3": ".mp3"}
+
+
+def data_uri_mime_type(data_uri):
+    # Only look at the header, data URIs of large outputs can be hundreds of MB
+    header = data_uri[5 : data_uri.find(",", 0, 256)]
+    return header.split(";", 1)[0]
+
+
+def data_uri_extension(data_uri, default_extension=""):
+    mime_type = data_uri_mime_type(data_uri)
+    extension = EXTENSION_OVERRIDES.get(mime_type) or mimetypes.guess_extension(
+        mime_type
+    )
+    return extension or default_extension
+
+
+def iter_data_uri_chunks(data_uri, chunk_size=DATA_URI_CHUNK_SIZE):
+    # Decode the payload slice by slice, so memory stays bounded by chunk_size
+    # instead of holding decoded copies of the whole file
+    payload_start = data_uri.index(",") + 1
+    if ";base64" not in data_uri[:payload_start]:
+        yield unquote_to_bytes(data_uri[payload_start:])
+        return
+    for start in range(payload_start, len(data_uri), chunk_size):
+        yield base64.b64decode(data_uri[start : start + chunk_size])
+
+
+class OutputStore:
+    # Content-addressed directory for decoded outputs: identical outputs are
+    # stored once and the least recently used files are evicted past max_size/max_age
+    def __init__(
+        self,
+        directory=DEFAULT_OUTPUT_DIR,
+        max_size=DEFAULT_OUTPUT_CACHE_SIZE,
+        max_age=DEFAULT_OUTPUT_MAX_AGE,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        existing = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in existing:
+            if entry.name.startswith(".tmp"):
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            self._entries[entry.path] = (stat.st_size, stat.st_mtime)
+            self._total_size += stat.st_size
+        self.evict()
+
+    def save_data_uri(self, data_uri, default_extension=""):
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".tmp", delete=False
+        ) as tmp_file:
+            for chunk in iter_data_uri_chunks(data_uri):
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        extension = data_uri_extension(data_uri, default_extension)
+        path = os.path.join(self.directory, digest.hexdigest() + extension)
+        with self._lock:
+            if path in self._entries:
+                os.remove(tmp_file.name)
+                os.utime(path)
+                size = self._entries.pop(path)[0]
+            else:
+                os.replace(tmp_file.name, path)
+                size = os.path.getsize(path)
+                self._total_size += size
+            self._entries[path] = (size, time.time())
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        now = time.time()
+        with self._lock:
+            for path, (size, last_used) in list(self._entries.items()):
+                over_size = self._total_size > self.max_size
+                expired = self.max_age and now - last_used > self.max_age
+                if not (over_size or expired):
+                    break
+                if path == keep:
+                    continue
+                del self._entries[path]
+                self._total_size -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,385 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from utils.http_helpers import backend_key
+
+DEFAULT_INITIAL_POLL_INTERVAL = 0.05
+DEFAULT_MAX_POLL_INTERVAL = 2.0
+DEFAULT_POLL_BACKOFF = 1.5
+DEFAULT_POLL_JITTER = 0.1
+DEFAULT_PREDICTION_TIMEOUT = 1800
+# While waiting for a webhook, poll once in a while in case it never arrives
+# (e.g. the Gradio app is not reachable from Replicate)
+DEFAULT_WEBHOOK_SAFETY_INTERVAL = 30
+# A canceled prediction keeps cog busy for a moment, the next one submitted
+# retries its 409 for this long
+DEFAULT_BUSY_RETRY_TIMEOUT = 10
+
+COMPLETION_MODES = ["poll", "webhook", "stream"]
+WEBHOOK_PATH = "/grog/webhook"
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def poll_intervals(
+    initial_interval=DEFAULT_INITIAL_POLL_INTERVAL,
+    max_interval=DEFAULT_MAX_POLL_INTERVAL,
+    backoff=DEFAULT_POLL_BACKOFF,
+    jitter=DEFAULT_POLL_JITTER,
+):
+    # Start fast for quick models and back off exponentially up to max_interval,
+    # with jitter so concurrent predictions don't poll in lockstep
+    interval = initial_interval
+    while True:
+        yield interval * random.uniform(1 - jitter, 1 + jitter)
+        interval = min(interval * backoff, max_interval)
+
+
+async def cancel_prediction(client, prediction, headers):
+    cancel_url = prediction.get("urls", {}).get("cancel")
+    if not cancel_url:
+        return
+    try:
+        await client.post(cancel_url, headers=headers)
+    except Exception as e:
+        print(f"Could not cancel prediction {prediction.get('id')}: {e}")
+
+
+async def fetch_prediction(client, prediction, headers):
+    response = await client.get(prediction["urls"]["get"], headers=headers)
+    if response.status_code in RETRY_STATUSES:
+        return prediction
+    response.raise_for_status()
+    return response.json()
+
+
+async def wait_for_prediction(
+    client,
+    prediction,
+    headers,
+    max_interval=DEFAULT_MAX_POLL_INTERVAL,
+    on_update=None,
+    stats=None,
+):
+    started = time.monotonic()
+    first_output_at = None
+    last_output = prediction.get("output")
+    intervals = poll_intervals(max_interval=max_interval)
+    while prediction["status"] not in TERMINAL_STATUSES:
+        await asyncio.sleep(next(intervals))
+        prediction = await fetch_prediction(client, prediction, headers)
+        output = prediction.get("output")
+        if first_output_at is None and output is not None:
+            first_output_at = time.monotonic()
+        if (
+            on_update is not None
+            and output != last_output
+            and prediction["status"] not in TERMINAL_STATUSES
+        ):
+            on_update(prediction)
+        last_output = output
+        if stats is not None:
+            stats["polls"] = stats.get("polls", 0) + 1
+
+    record_first_output(stats, (first_output_at or time.monotonic()) - started)
+    return prediction
+
+
+def record_first_output(stats, seconds):
+    # How long the first output took to show up, logged with the prediction
+    if stats is not None:
+        stats["first_output_seconds"] = round(seconds, 6)
+
+
+async def iter_sse_events(lines):
+    event, data = "message", []
+    async for line in lines:
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+    if data:
+        yield event, "\n".join(data)
+
+
+async def wait_for_stream(
+    client,
+    prediction,
+    headers,
+    max_interval=DEFAULT_MAX_POLL_INTERVAL,
+    on_update=None,
+    stats=None,
+):
+    stream_url = prediction.get("urls", {}).get("stream")
+    if not stream_url:
+        # The model doesn't support streaming, fall back to polling
+        return await wait_for_prediction(
+            client, prediction, headers, max_interval, on_update, stats
+        )
+    started = time.monotonic()
+    first_output_at = None
+    chunks = []
+    stream_headers = {
+        **headers,
+        "Accept": "text/event-stream",
+        "Cache-Control": "no-store",
+    }
+    async with client.stream("GET", stream_url, headers=stream_headers) as response:
+        response.raise_for_status()
+        async for event, data in iter_sse_events(response.aiter_lines()):
+            if event == "output":
+                first_output_at = first_output_at or time.monotonic()
+                chunks.append(data)
+                if on_update is not None:
+                    on_update(
+                        {**prediction, "status": "processing", "output": chunks[:]}
+                    )
+            elif event in ("done", "error"):
+                break
+
+    # The stream only carries output chunks, fetch the final prediction once
+    prediction = await fetch_prediction(client, prediction, headers)
+    if stats is not None:
+        stats["polls"] = stats.get("polls", 0) + 1
+    if prediction["status"] not in TERMINAL_STATUSES:
+        return await wait_for_prediction(
+            client, prediction, headers, max_interval, on_update, stats
+        )
+    record_first_output(stats, (first_output_at or time.monotonic()) - started)
+    return prediction
+
+
+class WebhookReceiver:
+    def __init__(self, secret=None, max_pending=1000):
+        self.secret = secret
+        # cog doesn't sign its webhooks, the URL it is given carries a token instead
+        self.token = secrets.token_urlsafe(32)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._results = OrderedDict()
+
+    def verify(self, body, headers):
+        # https://replicate.com/docs/webhooks#verifying-webhooks
+        webhook_id = headers.get("webhook-id")
+        timestamp = headers.get("webhook-timestamp")
+        signatures = headers.get("webhook-signature")
+        if not (webhook_id and timestamp and signatures):
+            return False
+        key = base64.b64decode(self.secret.split("_", 1)[-1])
+        signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+        expected = base64.b64encode(
+            hmac.new(key, signed_content, hashlib.sha256).digest()
+        ).decode()
+        return any(
+            hmac.compare_digest(expected, signature.split(",", 1)[-1])
+            for signature in signatures.split()
+        )
+
+    def _store(self, prediction):
+        # Webhooks can arrive before anyone waits on them, keep a bounded backlog
+        with self._lock:
+            self._results[prediction["id"]] = prediction
+            while len(self._results) > self.max_pending:
+                self._results.popitem(last=False)
+
+    def _resolve(self, future, prediction):
+        if future.done():
+            self._store(prediction)
+        else:
+            future.set_result(prediction)
+
+    def callback_url(self, url):
+        if self.secret:
+            return url
+        separator = "&" if "?" in url else "?"
+        return f"{url}{separator}token={self.token}"
+
+    def deliver(self, body, headers, token=None):
+        # False for webhooks that aren't authentic, ValueError for ones that
+        # don't carry a prediction
+        if self.secret:
+            if not self.verify(body, headers):
+                return False
+        elif not hmac.compare_digest(token or "", self.token):
+            return False
+        prediction = json.loads(body)
+        if not isinstance(prediction, dict) or "id" not in prediction:
+            raise ValueError("The webhook doesn't carry a prediction")
+        with self._lock:
+            waiter = self._waiters.pop(prediction["id"], None)
+        if waiter is None:
+            self._store(prediction)
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(self._resolve, future, prediction)
+        return True
+
+    async def wait(self, prediction_id, timeout=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if prediction_id in self._results:
+                return self._results.pop(prediction_id)
+            future = loop.create_future()
+            self._waiters[prediction_id] = (loop, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                if self._waiters.get(prediction_id, (None, None))[1] is future:
+                    del self._waiters[prediction_id]
+
+    def discard(self, prediction_id):
+        with self._lock:
+            self._waiters.pop(prediction_id, None)
+            self._results.pop(prediction_id, None)
+
+
+def fetch_webhook_secret(session, api_url, headers, request_timeout=None):
+    secret_url = f"{backend_key(api_url)}/v1/webhooks/default/secret"
+    try:
+        response = session.get(secret_url, headers=headers, timeout=request_timeout)
+        response.raise_for_status()
+        return response.json()["key"]
+    except Exception as e:
+        print(f"Could not fetch the webhook signing secret: {e}")
+        return None
+
+
+async def cog_is_busy(client, prediction):
+    # cog can't be asked about a prediction, only whether it is running one
+    health_url = f"{backend_key(prediction['urls']['cancel'])}/health-check"
+    response = await client.get(health_url)
+    response.raise_for_status()
+    return response.json().get("status") == "BUSY"
+
+
+async def wait_for_webhook(
+    client,
+    prediction,
+    headers,
+    receiver,
+    safety_interval=DEFAULT_WEBHOOK_SAFETY_INTERVAL,
+    on_update=None,
+    stats=None,
+):
+    started = time.monotonic()
+    first_output_at = None
+    try:
+        while prediction["status"] not in TERMINAL_STATUSES:
+            delivered = await receiver.wait(prediction["id"], safety_interval)
+            if delivered is not None:
+                # cog's webhooks don't carry the urls
+                prediction = {**prediction, **delivered}
+                if first_output_at is None and prediction.get("output") is not None:
+                    first_output_at = time.monotonic()
+                if (
+                    on_update is not None
+                    and prediction["status"] not in TERMINAL_STATUSES
+                ):
+                    on_update(prediction)
+                continue
+            if prediction.get("urls", {}).get("get"):
+                prediction = await fetch_prediction(client, prediction, headers)
+            elif not await cog_is_busy(client, prediction):
+                # Give a webhook sent as cog finished a second to arrive
+                delivered = await receiver.wait(prediction["id"], 1)
+                prediction = delivered or {
+                    **prediction,
+                    "status": "failed",
+                    "error": "The cog server finished without reporting the prediction",
+                }
+            if stats is not None:
+                stats["polls"] = stats.get("polls", 0) + 1
+    finally:
+        receiver.discard(prediction["id"])
+    record_first_output(stats, (first_output_at or time.monotonic()) - started)
+    return prediction
+
+
+async def wait_for_completion(
+    client,
+    prediction,
+    headers,
+    completion_mode="poll",
+    webhook_receiver=None,
+    max_interval=DEFAULT_MAX_POLL_INTERVAL,
+    timeout=DEFAULT_PREDICTION_TIMEOUT,
+    on_update=None,
+    stats=None,
+):
+    # stats, when given, counts the requests made to follow the prediction
+    if completion_mode == "stream":
+        waiter = wait_for_stream(
+            client, prediction, headers, max_interval, on_update, stats
+        )
+    elif completion_mode == "webhook" and webhook_receiver is not None:
+        waiter = wait_for_webhook(
+            client,
+            prediction,
+            headers,
+            webhook_receiver,
+            on_update=on_update,
+            stats=stats,
+        )
+    else:
+        waiter = wait_for_prediction(
+            client, prediction, headers, max_interval, on_update, stats
+        )
+    try:
+        return await asyncio.wait_for(waiter, timeout or None)
+    except asyncio.TimeoutError:
+        await cancel_prediction(client, prediction, headers)
+        raise TimeoutError(
+            f"Prediction {prediction.get('id')} did not finish in {timeout} seconds"
+        )
+    except asyncio.CancelledError:
+        # The Gradio event was canceled (e.g. the user left), stop the upstream work too
+        await cancel_prediction(client, prediction, headers)
+        raise
+
+
+async def watch_completion(client, prediction, headers, **kwargs):
+    # Yields every intermediate prediction carrying partial output, then the final one
+    updates = asyncio.Queue()
+    completion = asyncio.ensure_future(
+        wait_for_completion(
+            client, prediction, headers, on_update=updates.put_nowait, **kwargs
+        )
+    )
+    update = None
+    try:
+        while True:
+            update = asyncio.ensure_future(updates.get())
+            await asyncio.wait(
+                {completion, update}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not update.done():
+                yield completion.result()
+                return
+            yield update.result()
+    finally:
+        if update is not None:
+            update.cancel()
+        # Closing the generator early (e.g. Gradio canceled the event) cancels
+        # the prediction upstream
+        completion.cancel()
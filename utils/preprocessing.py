@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.file_inputs import file_mime_type
+
+# Options are looked up by input name first, then by file kind, e.g.
+# {"image": {"max_size": 1024, "format": "JPEG", "quality": 90},
+#  "audio": {"sample_rate": 16000, "channels": 1},
+#  "video": {"max_duration": 30},
+#  "mask": {"max_size": 1024, "format": "PNG"}}
+IMAGE_OPTIONS = ["max_size", "format", "quality"]
+AUDIO_OPTIONS = ["sample_rate", "channels", "format"]
+VIDEO_OPTIONS = ["max_duration"]
+KIND_OPTIONS = {"image": IMAGE_OPTIONS, "audio": AUDIO_OPTIONS, "video": VIDEO_OPTIONS}
+DEFAULT_IMAGE_QUALITY = 90
+
+preprocess_executor = None
+preprocess_executor_lock = threading.Lock()
+
+
+def load_preprocess_config(value):
+    # Either inline JSON or the path to a JSON file
+    if not value:
+        return {}
+    if os.path.exists(value):
+        with open(value, "r") as file:
+            config = json.load(file)
+    else:
+        config = json.loads(value)
+    # The kind of the files an input receives is only known once they arrive
+    input_options = IMAGE_OPTIONS + AUDIO_OPTIONS + VIDEO_OPTIONS
+    for name, options in config.items():
+        known_options = KIND_OPTIONS.get(name, input_options)
+        unknown = [option for option in options if option not in known_options]
+        if unknown:
+            raise Exception(f"Unknown preprocessing options for {name}: {unknown}")
+    return config
+
+
+def get_preprocess_executor():
+    # Decoding and re-encoding is CPU bound, keep it off the event loop and
+    # away from the default executor used to write outputs
+    global preprocess_executor
+    with preprocess_executor_lock:
+        if preprocess_executor is None:
+            preprocess_executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1, thread_name_prefix="grog_preprocess"
+            )
+    return preprocess_executor
+
+
+def preprocessed_path(path, extension):
+    # Written next to the upload, inside Gradio's cache, so it can still be
+    # served through /file= when it is too large to be sent inline
+    stem = os.path.splitext(path)[0]
+    return f"{stem}.preprocessed{extension}"
+
+
+def preprocess_image(path, max_size=None, format=None, quality=DEFAULT_IMAGE_QUALITY):
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        source_format = image.format
+        format = (format or source_format or "PNG").upper()
+        if not (max_size and max(image.size) > max_size) and format == source_format:
+            return path
+        # Phone photos are stored sideways with an EXIF orientation tag
+        image = ImageOps.exif_transpose(image)
+        if max_size:
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        extension = ".jpg" if format == "JPEG" else f".{format.lower()}"
+        output_path = preprocessed_path(path, extension)
+        save_options = {"quality": quality} if format in ("JPEG", "WEBP") else {}
+        image.save(output_path, format=format, **save_options)
+    return output_path
+
+
+def run_ffmpeg(path, output_path, arguments):
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg is not installed, audio and video inputs are sent unprocessed")
+        return path
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", path, *arguments, output_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(f"Could not preprocess {path}, sending it unprocessed: {result.stderr}")
+        return path
+    return output_path
+
+
+def preprocess_audio(path, sample_rate=None, channels=None, format=None):
+    arguments = []
+    if sample_rate:
+        arguments += ["-ar", str(sample_rate)]
+    if channels:
+        arguments += ["-ac", str(channels)]
+    extension = f".{format.lower()}" if format else os.path.splitext(path)[1]
+    if not arguments and extension == os.path.splitext(path)[1]:
+        return path
+    return run_ffmpeg(path, preprocessed_path(path, extension), arguments)
+
+
+def preprocess_video(path, max_duration=None):
+    if not max_duration:
+        return path
+    # Cut on keyframes without re-encoding, which takes milliseconds
+    extension = os.path.splitext(path)[1]
+    return run_ffmpeg(
+        path,
+        preprocessed_path(path, extension),
+        ["-t", str(max_duration), "-c", "copy"],
+    )
+
+
+def preprocess_file(path, name, config):
+    kind = file_mime_type(path).split("/")[0]
+    options = config.get(name) or config.get(kind)
+    if not options or kind not in KIND_OPTIONS:
+        return path
+    # Options of an input can be meant for another kind of file, e.g. an image
+    # max_size for an input that also takes videos
+    options = {
+        option: value
+        for option, value in options.items()
+        if option in KIND_OPTIONS[kind]
+    }
+    if kind == "image":
+        return preprocess_image(path, **options)
+    elif kind == "audio":
+        return preprocess_audio(path, **options)
+    elif kind == "video":
+        return preprocess_video(path, **options)
+    return path
+
+
+async def preprocess_input(path, name, config):
+    if not config:
+        return path
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_preprocess_executor(), preprocess_file, path, name, config
+    )
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_RESULT_CACHE_SIZE = 256
+# Outputs kept as data URIs can be several MB each
+DEFAULT_RESULT_CACHE_MAX_SIZE = 64 * 1024**2
+# Replicate deletes the files of API predictions after an hour, the cached
+# output URLs have to go before that
+DEFAULT_REPLICATE_RESULT_MAX_AGE = 3000
+# Without a seed most models are not deterministic, so don't cache those predictions
+DEFAULT_UNCACHEABLE_IF_EMPTY = ["seed"]
+
+
+def payload_key(inputs, model_version):
+    canonical_inputs = json.dumps(
+        {
+            "version": model_version,
+            "input": {
+                name: value
+                for name, value in inputs.items()
+                if value is not None and value != ""
+            },
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical_inputs.encode()).hexdigest()
+
+
+def output_size(output):
+    # Roughly the memory held by a decoded JSON output, without serializing it
+    if isinstance(output, str):
+        return len(output)
+    if isinstance(output, dict):
+        return sum(len(key) + output_size(value) for key, value in output.items())
+    if isinstance(output, list):
+        return sum(output_size(value) for value in output)
+    return 8
+
+
+class ResultCache:
+    # Prediction outputs keyed on the normalized inputs and the model version, kept
+    # in an in-memory LRU bounded in entries and bytes and optionally persisted as
+    # one JSON file per entry. Entries older than max_age seconds (0 for no
+    # limit) are dropped, in memory and on disk
+    def __init__(
+        self,
+        model_version,
+        max_entries=DEFAULT_RESULT_CACHE_SIZE,
+        directory=None,
+        uncacheable_if_empty=DEFAULT_UNCACHEABLE_IF_EMPTY,
+        max_size=DEFAULT_RESULT_CACHE_MAX_SIZE,
+        max_age=0,
+    ):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.directory = directory
+        self.uncacheable_if_empty = uncacheable_if_empty
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        # key -> (output, size, created)
+        self._entries = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, inputs):
+        # Only the inputs the model has, most models have no seed
+        for name in self.uncacheable_if_empty:
+            if name in inputs and inputs[name] in (None, ""):
+                return None
+        return payload_key(inputs, self.model_version)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _expired(self, created):
+        return self.max_age and time.time() - created > self.max_age
+
+    def get(self, key, valid=None):
+        # valid(output) returning False drops the entry, e.g. when the files it
+        # points to are gone
+        with self._lock:
+            if key in self._entries:
+                output, _, created = self._entries[key]
+                if not self._expired(created) and (valid is None or valid(output)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return output
+                self._remove(key)
+        output = None
+        path = self._path(key) if self.directory else None
+        if path and os.path.exists(path):
+            created = os.path.getmtime(path)
+            if not self._expired(created):
+                with open(path, "r") as file:
+                    output = json.load(file)["output"]
+                if valid is not None and not valid(output):
+                    output = None
+            if output is None:
+                os.remove(path)
+        with self._lock:
+            if output is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, output, output_size(output), created)
+        return output
+
+    def set(self, key, output):
+        with self._lock:
+            self._store(key, output, output_size(output), time.time())
+        if self.directory:
+            tmp_path = f"{self._path(key)}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"version": self.model_version, "output": output}, file)
+            os.replace(tmp_path, self._path(key))
+
+    def _store(self, key, output, size, created):
+        if key in self._entries:
+            self._remove(key)
+        # Larger outputs are only kept on disk, if at all
+        if size > self.max_size:
+            return
+        self._entries[key] = (output, size, created)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_size:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "size": self.size,
+            }
@@ -0,0 +1,56 @@
+import asyncio
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one run of the underlying async
+    # iterator: every item it yields is fanned out to all of them
+    def __init__(self):
+        self._flights = {}
+
+    def in_flight(self):
+        return len(self._flights)
+
+    async def subscribe(self, key, factory):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = {"subscribers": set(), "latest": None}
+            self._flights[key] = flight
+            flight["task"] = asyncio.ensure_future(self._run(key, flight, factory()))
+        queue = asyncio.Queue()
+        # Late joiners start from the latest partial result
+        if flight["latest"] is not None:
+            queue.put_nowait(("item", flight["latest"]))
+        flight["subscribers"].add(queue)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "item":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            flight["subscribers"].discard(queue)
+            # Stop the shared work once nobody is waiting for it anymore
+            if not flight["subscribers"] and not flight["task"].done():
+                flight["task"].cancel()
+
+    async def _run(self, key, flight, source):
+        try:
+            async for item in source:
+                flight["latest"] = item
+                self._broadcast(flight, ("item", item))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._broadcast(flight, ("error", e))
+        else:
+            self._broadcast(flight, ("done", None))
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _broadcast(self, flight, message):
+        for queue in flight["subscribers"]:
+            queue.put_nowait(message)
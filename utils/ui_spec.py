@@ -0,0 +1,179 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# A UI spec describes the Gradio components of a model as plain data, e.g.
+# {"type": "Slider", "kwargs": {"label": "Steps", "minimum": 1, ...}}. It is
+# built once per schema and rendered either to live components (dynamic apps)
+# or to the source of an app.py (static apps), so both always match
+DEFAULT_UI_SPEC_CACHE_SIZE = 256
+
+ui_spec_cache = OrderedDict()
+ui_spec_cache_lock = threading.Lock()
+
+
+def extract_property_info(prop):
+    combined_prop = {}
+    merge_keywords = ["allOf", "anyOf", "oneOf"]
+
+    for keyword in merge_keywords:
+        if keyword in prop:
+            for subprop in prop[keyword]:
+                combined_prop.update(subprop)
+            del prop[keyword]
+
+    if not combined_prop:
+        combined_prop = prop.copy()
+
+    for key in ["description", "default"]:
+        if key in prop:
+            combined_prop[key] = prop[key]
+
+    return combined_prop
+
+
+def detect_file_type(filename):
+    audio_extensions = [".mp3", ".wav", ".flac", ".aac", ".ogg", ".m4a"]
+    image_extensions = [
+        ".jpg",
+        ".jpeg",
+        ".png",
+        ".gif",
+        ".bmp",
+        ".tiff",
+        ".svg",
+        ".webp",
+    ]
+    video_extensions = [
+        ".mp4",
+        ".mov",
+        ".wmv",
+        ".flv",
+        ".avi",
+        ".avchd",
+        ".mkv",
+        ".webm",
+    ]
+
+    # Extract the file extension
+    if isinstance(filename, str):
+        extension = filename[filename.rfind(".") :].lower()
+
+        # Check the extension against each list
+        if extension in audio_extensions:
+            return "audio"
+        elif extension in image_extensions:
+            return "image"
+        elif extension in video_extensions:
+            return "video"
+        else:
+            return "string"
+    elif isinstance(filename, list):
+        return "list"
+
+
+def component(component_type, **kwargs):
+    return {"type": component_type, "kwargs": kwargs}
+
+
+def input_component(name, prop, example_inputs=None):
+    prop = extract_property_info(dict(prop))
+    label = prop.get("title")
+    info = prop.get("description")
+    if "enum" in prop:
+        return component(
+            "Dropdown",
+            choices=prop["enum"],
+            label=label,
+            info=info,
+            value=prop.get("default"),
+        )
+    elif prop["type"] in ("integer", "number"):
+        if prop.get("minimum") and prop.get("maximum"):
+            step = {"step": 1} if prop["type"] == "integer" else {}
+            return component(
+                "Slider",
+                label=label,
+                info=info,
+                value=prop.get("default"),
+                minimum=prop.get("minimum"),
+                maximum=prop.get("maximum"),
+                **step,
+            )
+        return component("Number", label=label, info=info, value=prop.get("default"))
+    elif prop["type"] == "boolean":
+        return component("Checkbox", label=label, info=info, value=prop.get("default"))
+    elif prop["type"] == "string" and prop.get("format") == "uri" and example_inputs:
+        input_type_example = example_inputs.get(name, None)
+        input_type = (
+            detect_file_type(input_type_example) if input_type_example else None
+        )
+        if input_type == "image":
+            return component("Image", label=label, type="filepath")
+        elif input_type == "audio":
+            return component("Audio", label=label, type="filepath")
+        elif input_type == "video":
+            return component("Video", label=label)
+        return component("File", label=label)
+    return component("Textbox", label=label, info=info)
+
+
+def output_component(output_type):
+    if output_type == "image":
+        return component("Image")
+    elif output_type == "audio":
+        return component("Audio", type="filepath")
+    elif output_type == "video":
+        return component("Video")
+    elif output_type == "string":
+        return component("Textbox")
+    return component("JSON")
+
+
+def ui_spec_key(ordered_input_schema, example_inputs, output_types):
+    canonical = json.dumps(
+        [ordered_input_schema, example_inputs, output_types],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def build_ui_spec(ordered_input_schema, example_inputs=None, output_types=None):
+    # Models sharing a schema (e.g. versions of one model) share their spec
+    key = ui_spec_key(ordered_input_schema, example_inputs, output_types)
+    with ui_spec_cache_lock:
+        if key in ui_spec_cache:
+            ui_spec_cache.move_to_end(key)
+            return ui_spec_cache[key]
+    spec = {
+        "names": [name for name, _ in ordered_input_schema],
+        "inputs": [
+            input_component(name, prop, example_inputs)
+            for name, prop in ordered_input_schema
+        ],
+        "outputs": [output_component(output) for output in output_types or ["json"]],
+    }
+    with ui_spec_cache_lock:
+        ui_spec_cache[key] = spec
+        while len(ui_spec_cache) > DEFAULT_UI_SPEC_CACHE_SIZE:
+            ui_spec_cache.popitem(last=False)
+    return spec
+
+
+def render_components(components):
+    import gradio as gr
+
+    return [getattr(gr, c["type"])(**c["kwargs"]) for c in components]
+
+
+def render_source(components, list_name):
+    source = f"{list_name} = []\n"
+    for c in components:
+        arguments = ", ".join(f"{key}={value!r}" for key, value in c["kwargs"].items())
+        if arguments:
+            arguments = f"\n    {arguments}\n"
+        source += f"{list_name}.append(gr.{c['type']}({arguments}))\n\n"
+    return source